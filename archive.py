@@ -0,0 +1,126 @@
+import gzip
+import hashlib
+import json
+import os
+import sys
+
+""" Append only per season archive of scraped JSON documents, replacing one pretty printed file per match.
+Each record is written as its own gzip member appended to {folder}/{season}.jsonl.gz, so the file is
+valid gzipped JSONL and an append never rewrites earlier data. {season}.idx holds one line per record
+(name, offset, length, sha1) so a single record can be read with one seek, and a loader can read the
+whole season with one sequential read. Writing a name again appends a new record that replaces the old
+one in the index. Run this module with a folder of json files and an archive folder to pack them."""
+
+def get_record_hash(raw_data):
+    return hashlib.sha1(raw_data).hexdigest()
+
+def load_record(raw_data):
+    return json.loads(raw_data)["data"]
+
+class JSONArchive():
+    def __init__(self, folder):
+        self.folder = folder
+        self.indexes = {}
+        os.makedirs(folder, exist_ok=True)
+
+    def get_paths(self, season):
+        archive_path = os.path.join(self.folder, f"{season}.jsonl.gz")
+        index_path = os.path.join(self.folder, f"{season}.idx")
+        return archive_path, index_path
+
+    def get_seasons(self):
+        return sorted([x.replace(".jsonl.gz", "") for x in os.listdir(self.folder) if x.endswith(".jsonl.gz")])
+
+    def get_index(self, season):
+        if season in self.indexes:
+            return self.indexes[season]
+        index = {}
+        _, index_path = self.get_paths(season)
+        if os.path.exists(index_path):
+            with open(index_path, "r") as f:
+                for line in f:
+                    parts = line.rstrip("\n").split("\t")
+                    if len(parts) != 4:
+                        # torn write at the end of the index, the record is ignored
+                        continue
+                    index[parts[0]] = (int(parts[1]), int(parts[2]), parts[3])
+        self.indexes[season] = index
+        return index
+
+    def get_names(self):
+        names = set()
+        for season in self.get_seasons():
+            names |= set(self.get_index(season).keys())
+        return names
+
+    def contains(self, season, name):
+        return name in self.get_index(str(season))
+
+    def append(self, season, name, data):
+        season = str(season)
+        raw_data = (json.dumps({"name": name, "data": data}, separators=(",", ":")) + "\n").encode("utf-8")
+        member = gzip.compress(raw_data)
+        archive_path, index_path = self.get_paths(season)
+        index = self.get_index(season)
+        with open(archive_path, "ab") as f:
+            offset = f.tell()
+            f.write(member)
+            f.flush()
+            os.fsync(f.fileno())
+        record_hash = get_record_hash(raw_data)
+        with open(index_path, "a") as f:
+            f.write(f"{name}\t{offset}\t{len(member)}\t{record_hash}\n")
+        index[name] = (offset, len(member), record_hash)
+
+    def read(self, season, name):
+        offset, length, _ = self.get_index(str(season))[name]
+        archive_path, _ = self.get_paths(str(season))
+        with open(archive_path, "rb") as f:
+            f.seek(offset)
+            return load_record(gzip.decompress(f.read(length)))
+
+    def iter_raw(self, season):
+        """
+        Yields (name, raw_data, sha1) for the current record of every name in a season, in the order
+        they were written, from a single read of the archive file.
+        """
+        season = str(season)
+        archive_path, _ = self.get_paths(season)
+        entries = sorted(self.get_index(season).items(), key=lambda x: x[1][0])
+        with open(archive_path, "rb") as f:
+            packed = f.read()
+        for name, (offset, length, record_hash) in entries:
+            yield name, gzip.decompress(packed[offset:offset + length]), record_hash
+
+    def iter_season(self, season):
+        for name, raw_data, _ in self.iter_raw(season):
+            yield name, load_record(raw_data)
+
+
+def pack_folder(folder, archive_folder, season_key=None, remove=False):
+    """
+    Packs every json file of a folder into the archive. The season is the document's season_key
+    field, or the first four characters of the filename (e.g. 2025_1111050.json) when it is None.
+    """
+    archive = JSONArchive(archive_folder)
+    for filename in sorted(os.listdir(folder)):
+        if not filename.endswith(".json"):
+            continue
+        filepath = os.path.join(folder, filename)
+        with open(filepath, "r") as f:
+            data = json.load(f)
+        season = str(data[season_key]) if season_key else filename[:4]
+        if not archive.contains(season, filename):
+            archive.append(season, filename, data)
+        if remove:
+            os.remove(filepath)
+    print("INFO", f"Packed {folder} into {archive_folder}")
+
+
+if __name__ == "__main__":
+    # e.g. python3 archive.py matches/Completed matches/archive --season-key=year --remove
+    season_key = None
+    for arg in sys.argv[3:]:
+        if arg.startswith("--season-key="):
+            season_key = arg.split("=", 1)[1]
+    pack_folder(sys.argv[1], sys.argv[2], season_key=season_key, remove="--remove" in sys.argv)
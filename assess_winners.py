@@ -1,112 +1,93 @@
 from sqlite_wrapper import SQLiteWrapper
+from player_game_stats import PlayerGameStats, NRL_SOURCE
+import sys
 """ This is a module to assess all of the games that have been imported and correct the incorrect scores to match the points scored by the below on-field actions. There were some games prior to 2013 where the json had conflicting info between who scored points and what the total team points were. The sum of individual points proved to be correct"""
-def get_games(wrapper):
-    query = """SELECT id FROM games WHERE complete = 1;"""
-    output = wrapper.fetch_all(query)
-    return [x[0] for x in output]
-def get_nrl_stats(wrapper):
-    query = """SELECT games.id, team_id, stat_type, SUM(value)
-            FROM nrl_ps
-            JOIN player_performance ON nrl_ps.player_performance_id = player_performance.id
-            JOIN games ON games.id = player_performance.game_id
-            WHERE (stat_type = "tries" 
-                OR stat_type = "conversions"
-                OR stat_type = "fieldGoals"
-                OR stat_type = "goals"
-                OR stat_type = "penaltyGoals"
-                OR stat_type = "twoPointFieldGoals")
-            GROUP BY games.id,team_id, stat_type;"""
-    data = wrapper.fetch_all(query)
-    output = {}
-    for line in data:
-        output[line[0]] = []
-    for line in data:
-        output[line[0]].append(line[1:])
-    return output
+ACTION_SCORE = {
+        'conversions':2, 
+        'fieldGoals': 1,
+        'goals': 2,
+        'penaltyGoals': 2,
+        'tries': 4,
+        'twoPointFieldGoals': 1 # 1 point as they record it as both a field goal and 2p field goal
+        }
+# watermarks row of the highest player_performance id already checked, runs only check games with
+# newer performances
+WATERMARK = "assess_winners"
 
-def match_scores(calced_scores, recorded_scores):
-    if not sorted(list(calced_scores.keys())) == sorted(list(recorded_scores.keys())):
-        return False
+def get_score_expression(wrapper):
+    stats_table = PlayerGameStats(wrapper)
+    terms = [f'COALESCE(player_game_stats."{x}", 0) * {points}' for x, points in ACTION_SCORE.items() if stats_table.has_column(x)]
+    return " + ".join(terms)
 
-    for key, item in calced_scores.items():
-        if recorded_scores[key] != item:
-            return False
+def get_mismatches(wrapper, after_performance_id=0):
+    """
+    Sums the scoring stats of every team in one aggregation and returns (game_id, team_id,
+    calculated score, calculated conceded, recorded score) for the teams whose game_teams score
+    or conceded differ. Only the nrl.com performances are summed, and only games with nrl.com stats
+    for both teams and a performance newer than after_performance_id are checked.
+    """
+    score_expression = get_score_expression(wrapper)
+    if not score_expression:
+        return []
+    query = f"""WITH calculated AS (
+                SELECT player_performance.game_id, player_performance.team_id, CAST(SUM({score_expression}) AS INTEGER) AS score
+                FROM games
+                JOIN player_performance ON player_performance.game_id = games.id
+                JOIN player_game_stats ON player_game_stats.player_performance_id = player_performance.id
+                WHERE games.complete = 1
+                AND games.nrl_stats_loaded = 1
+                AND player_performance.source = ?
+                AND games.id IN (SELECT game_id FROM player_performance WHERE id > ?)
+                GROUP BY player_performance.game_id, player_performance.team_id)
+            SELECT calculated.game_id, calculated.team_id, calculated.score, opponent.score, game_teams.score
+            FROM calculated
+            JOIN calculated opponent ON opponent.game_id = calculated.game_id AND opponent.team_id != calculated.team_id
+            JOIN game_teams ON game_teams.game_id = calculated.game_id AND game_teams.team_id = calculated.team_id
+            WHERE game_teams.score IS NOT calculated.score
+            OR game_teams.conceded IS NOT opponent.score
+            ORDER BY calculated.game_id, calculated.team_id;"""
+    return wrapper.fetch_all(query, (NRL_SOURCE, after_performance_id))
 
-    return True
-def set_game_scores(game, scores, wrapper):
-    query = """UPDATE game_teams SET score = ?, conceded = ? WHERE game_id = ? AND team_id = ?;"""
-    team_ids = list(scores.keys())
-    team_id0 = team_ids[0]
-    team_id1 = team_ids[1]
-    score_0 = scores[team_id0]
-    score_1 = scores[team_id1]
-    parameters =  [(score_0, score_1, game, team_id0),
-                   (score_1, score_0, game, team_id1)]
-    wrapper.execute_many(query, parameters)
-    
-def analyze_game(game, wrapper, nrl_recorded_scores, nrl_stats):
-    action_score = {
-            'conversions':2, 
-            'fieldGoals': 1,
-            'goals': 2,
-            'penaltyGoals': 2,
-            'tries': 4,
-            'twoPointFieldGoals': 1 # 1 point as they record it as both a field goal and 2p field goal
-            }
-    data = nrl_stats[game]
-    team_ids = list(set([x[0] for x in data]))
-    scores = {x:0 for x in team_ids}
-    for line in data:
-        scores[line[0]] += int(line[2] * action_score[line[1]])
+def set_game_scores(score_rows, wrapper):
+    count = wrapper.bulk_upsert("game_teams", ["game_id", "team_id"], ["score", "conceded"], score_rows)
+    print("INFO", f"{count} scores corrected")
 
-    if not match_scores(scores, nrl_recorded_scores[game]):
-        print(f"Game:{game}  team {team_ids[0]:2d} calculated_score:{scores[team_ids[0]]:3d} nrl_score:{nrl_recorded_scores[game][team_ids[0]]:3d}")
-        print(f"Game:{game}  team {team_ids[1]:2d} calculated_score:{scores[team_ids[1]]:3d} nrl_score:{nrl_recorded_scores[game][team_ids[1]]:3d}")
-        print()
-        set_game_scores(game, scores, wrapper)
-
-
-def get_game_scores(wrapper):
-    query = """SELECT game_id, team_id, score
+def update_winners(wrapper):
+    # comp points of every complete game from its scores, only changed rows are written
+    query = """SELECT game_teams.game_id, game_teams.team_id,
+                CASE WHEN game_teams.score > opponent.score THEN 2
+                    WHEN game_teams.score < opponent.score THEN 0
+                    ELSE 1 END
             FROM game_teams
-            JOIN games ON game_teams.game_id = games.id
-            WHERE games.complete is 1;"""
-    raw_data = wrapper.fetch_all(query)
-    nrl_raw_scores = {}
-    for item in raw_data:
-        nrl_raw_scores[item[0]] = {}
-    for item in raw_data:
-        nrl_raw_scores[item[0]][item[1]] = item[2]
-    return nrl_raw_scores
-
-def return_points_from_scores(scores):
-    ids = list(scores.keys())
-    if scores[ids[0]] > scores[ids[1]]:
-        return [(ids[0],2), (ids[1],0)]
-    elif scores[ids[0]] < scores[ids[1]]:
-        return [(ids[0],0), (ids[1],2)]
-    return [(ids[0],1), (ids[1],1)]
-
-def update_winners(wrapper, nrl_recorded_scores):
-    parameters = []
-    query = """UPDATE game_teams SET comp_points = ?
-                    WHERE game_id = ?
-                    AND team_id = ?;"""
-    for key, item in nrl_recorded_scores.items():
-        comp_points = return_points_from_scores(item)
-        parameters.append((comp_points[0][1], key, comp_points[0][0]))
-        parameters.append((comp_points[1][1], key, comp_points[1][0]))
-    wrapper.execute_many(query, parameters)
+            JOIN game_teams opponent ON opponent.game_id = game_teams.game_id AND opponent.team_id != game_teams.team_id
+            JOIN games ON games.id = game_teams.game_id
+            WHERE games.complete = 1;"""
+    rows = wrapper.fetch_all(query)
+    count = wrapper.bulk_upsert("game_teams", ["game_id", "team_id"], ["comp_points"], rows)
+    print("INFO", f"{count} comp_points changed")
 
+def get_checked_performance_id(wrapper):
+    row = wrapper.fetch_one("SELECT value FROM watermarks WHERE name = ?;", (WATERMARK,))
+    return row[0] if row is not None else 0
 
-    
+def save_checked_performance_id(max_performance_id, wrapper):
+    query = """INSERT INTO watermarks (name, value) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET value = excluded.value;"""
+    wrapper.execute_query(query, (WATERMARK, max_performance_id))
 
 
-wrapper = SQLiteWrapper(db_name = "/home/paul/Projects/NRLAnalysis/database.db")
-wrapper.connect()
-games = (get_games(wrapper))
-nrl_recorded_scores = get_game_scores(wrapper)
-nrl_stats = get_nrl_stats(wrapper)
-update_winners(wrapper, nrl_recorded_scores)
-for game in games[:]:
-    analyze_game(game, wrapper, nrl_recorded_scores, nrl_stats)
+if __name__ == "__main__":
+    wrapper = SQLiteWrapper(db_name = "/home/paul/Projects/NRLAnalysis/database.db")
+    wrapper.connect()
+    # --all checks every game again
+    after_performance_id = 0 if "--all" in sys.argv else get_checked_performance_id(wrapper)
+    # the corrections and the watermark are committed together so they cannot drift apart
+    with wrapper.transaction():
+        max_performance_id = wrapper.fetch_one("SELECT COALESCE(MAX(id), 0) FROM player_performance;")[0]
+        mismatches = get_mismatches(wrapper, after_performance_id)
+        for game, team_id, score, conceded, recorded_score in mismatches:
+            print(f"Game:{game}  team {team_id:2d} calculated_score:{score:3d} nrl_score:{recorded_score if recorded_score is not None else -1:3d}")
+        set_game_scores([x[:4] for x in mismatches], wrapper)
+        update_winners(wrapper)
+        save_checked_performance_id(max_performance_id, wrapper)
+    wrapper.close()
@@ -0,0 +1,96 @@
+import json
+import os
+
+""" Crash safe JSON progress files for long scrapes. Every change is appended to {filepath}.log as one
+line, and every compact_every changes the state is written to {filepath} through a temp file and
+os.replace before the log is truncated, so the snapshot is never seen half written. Changes are
+idempotent (set a value, add to a list if absent) so replaying a log that was already compacted into
+the snapshot is harmless."""
+
+def write_json_atomic(filepath, data):
+    temp_path = f"{filepath}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, filepath)
+
+class CheckpointStore():
+    def __init__(self, filepath, compact_every=100, default=None):
+        self.filepath = filepath
+        self.log_filepath = filepath + ".log"
+        self.compact_every = compact_every
+        self.pending = 0
+        self.load(default)
+
+    def load(self, default):
+        """
+        Reads the snapshot and replays the log over it. A missing or empty snapshot starts from
+        default, or raises FileNotFoundError when there is no default.
+        """
+        try:
+            with open(self.filepath, "r") as f:
+                content = f.read()
+            self.state = json.loads(content) if content.strip() else None
+        except FileNotFoundError:
+            if default is None:
+                raise
+            self.state = None
+        if self.state is None:
+            if default is None:
+                raise FileNotFoundError(f"{self.filepath} is empty")
+            self.state = default
+        if not os.path.exists(self.log_filepath):
+            return
+        with open(self.log_filepath, "r") as f:
+            for line in f:
+                try:
+                    op, keys, value = json.loads(line)
+                except ValueError:
+                    # torn write at the end of the log
+                    break
+                self.apply(op, keys, value)
+                self.pending += 1
+
+    def apply(self, op, keys, value):
+        container = self.state
+        for key in keys[:-1]:
+            container = container.setdefault(key, {})
+        if op == "set":
+            container[keys[-1]] = value
+        elif op == "add":
+            values = container.setdefault(keys[-1], [])
+            if value not in values:
+                values.append(value)
+
+    def write(self, op, keys, value):
+        keys = [str(x) for x in keys]
+        self.apply(op, keys, value)
+        with open(self.log_filepath, "a") as f:
+            f.write(json.dumps([op, keys, value]) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.pending += 1
+        if self.pending >= self.compact_every:
+            self.compact()
+
+    def set(self, keys, value):
+        self.write("set", keys, value)
+
+    def add(self, keys, value):
+        self.write("add", keys, value)
+
+    def get(self, key, default=None):
+        return self.state.get(str(key), default)
+
+    def __contains__(self, key):
+        return str(key) in self.state
+
+    def compact(self):
+        write_json_atomic(self.filepath, self.state)
+        open(self.log_filepath, "w").close()
+        self.pending = 0
+
+    def close(self):
+        if self.pending:
+            self.compact()
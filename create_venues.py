@@ -5,9 +5,7 @@ import csv
 def load_venue(sqlitewrapper, rlp_id, venue_data):
     query = "INSERT INTO venues (name, rlp_id, latitude, longitude) VALUES (?, ?, ?, ?);"
     parameters = (venue_data["name"], rlp_id, venue_data["latitude"], venue_data["longitude"])
-    sqlitewrapper.execute_query(query, parameters)
-    query = "SELECT MAX(id) FROM venues;"
-    pk = sqlitewrapper.fetch_one(query)[0]
+    pk = sqlitewrapper.insert(query, parameters)
     ff_venues = venue_data.get("ff_venue_id")
     if not ff_venues:
         return
@@ -20,7 +18,7 @@ def load_venue(sqlitewrapper, rlp_id, venue_data):
 
 
 
-sqlitewrapper = SQLiteWrapper(db_name = "/home/paul/Projects/NRLAnalysis/database.db")
+sqlitewrapper = SQLiteWrapper(db_name = "/home/paul/Projects/NRLAnalysis/database.db", profile = "bulk-load")
 sqlitewrapper.connect()
 
 with open("venues.json","r") as f:
@@ -1,6 +1,8 @@
 import matplotlib.pyplot as plt
 import sys
 from sqlite_wrapper import SQLiteWrapper
+from player_game_stats import PlayerGameStats, FANTASY_SOURCE
+from feature_store import FeatureStore
 import numpy as np
 from scipy import stats
 import statsmodels.api as sm
@@ -13,63 +15,59 @@ from statsmodels.stats.outliers_influence import variance_inflation_factor
 class Regression():
     def __init__(self):
         self.base_folder = "/home/paul/Projects/NRLAnalysis/"
-        self.wrapper = SQLiteWrapper(db_name = f"{self.base_folder}database.db")
-
-
-    def get_stat(self, stat, start_year, end_year, home):
-        query = '''SELECT
-            games.id,
-            SUM(player_stats.count)
-            FROM games 
-            JOIN player_performance ON player_performance.game_id = games.id
-            JOIN player_stats ON player_stats.player_performance_id = player_performance.id
-            WHERE player_stats.stat_type = ? 
-            AND games.year >= ? 
-            AND games.year <= ? 
-            AND player_stats.is_home_team = ? GROUP BY games.id;''' 
-        parameters = (stat, start_year, end_year, home)
-        data = self.wrapper.fetch_all(query, parameters)
-        return data
-
-
-    def get_teams(self, start_year, end_year, is_home):
-        query = '''SELECT 
-            teams.name
-            FROM games 
-            JOIN game_teams ON games.id = game_teams.game_id
-            JOIN teams on teams.id = game_teams.team_id
-            WHERE games.year >= ?
-            AND games.year <= ? 
-            AND game_teams.is_home_team = ?
-            GROUP BY games.id;'''
-        parameters = (start_year, end_year, is_home)
-        data = self.wrapper.fetch_all(query, parameters)
-        return data
-
-
-    def get_points(self, start_year, end_year, is_home):
-        query = '''SELECT 
-            games.id,
-            SUM(game_teams.score)
-            FROM games 
-            JOIN game_teams ON games.id = game_teams.game_id
-            JOIN teams on teams.id = game_teams.team_id
-            WHERE games.year >= ?
-            AND games.year <= ?
-            AND game_teams.is_home_team = ?
-            GROUP BY games.id, game_teams.team_id;'''
-        parameters = (start_year, end_year, is_home)
-        data = self.wrapper.fetch_all(query, parameters)
-        return data
-
-    def get_delta_frame(self, data1, data2, statistic):
-        df = pd.DataFrame(columns = ['game_id'])
-        df = df.merge(pd.DataFrame(data1, columns = ["game_id", "1"]), on=["game_id"], how="outer")
-        df = df.merge(pd.DataFrame(data2, columns = ["game_id", "2"]), on=["game_id"], how="outer")
-        df=df.fillna(0)
-        df[statistic] = df["1"] - df["2"]
-        df = df.drop("1", axis=1)
-        df = df.drop("2", axis=1)
+        self.wrapper = SQLiteWrapper(db_name = f"{self.base_folder}database.db", profile = "analytics")
+        self.feature_store = FeatureStore(self.wrapper, os.path.join(self.base_folder, "features"))
+
+
+    def get_feature_query(self, params):
+        """
+        One pass over the games in a year range with an id above after_game_id: the home minus away
+        sum of every stat in params over the fantasy performances, the home and away team names and the
+        home minus away points margin.
+        """
+        for stat in params:
+            if not self.stats_table.has_column(stat):
+                raise ValueError(f"{stat} is not a column of player_game_stats")
+        deltas = [f'''COALESCE(SUM(CASE WHEN player_game_stats.is_home_team = 1
+                THEN player_game_stats."{x}" ELSE -player_game_stats."{x}" END), 0) AS "{x}"''' for x in params]
+        stat_columns = [f'COALESCE(stat_deltas."{x}", 0)' for x in params]
+        stat_deltas = ""
+        if params:
+            stat_deltas = f'''stat_deltas AS (
+                SELECT player_performance.game_id, {", ".join(deltas)}
+                FROM games
+                JOIN player_performance ON player_performance.game_id = games.id
+                JOIN player_game_stats ON player_game_stats.player_performance_id = player_performance.id
+                WHERE games.year >= ? AND games.year <= ? AND games.id > ?
+                AND player_performance.source = ?
+                GROUP BY player_performance.game_id),'''
+        query = f'''WITH {stat_deltas}
+            game_sides AS (
+                SELECT
+                    game_teams.game_id,
+                    MAX(CASE WHEN game_teams.is_home_team = 1 THEN teams.name END) AS home,
+                    MAX(CASE WHEN game_teams.is_home_team = 0 THEN teams.name END) AS away,
+                    COALESCE(SUM(CASE WHEN game_teams.is_home_team = 1 THEN game_teams.score ELSE -game_teams.score END), 0) AS points
+                FROM games
+                JOIN game_teams ON game_teams.game_id = games.id
+                JOIN teams ON teams.id = game_teams.team_id
+                WHERE games.year >= ? AND games.year <= ? AND games.id > ?
+                GROUP BY game_teams.game_id)
+            SELECT {", ".join(["game_sides.game_id"] + stat_columns + ["game_sides.home", "game_sides.away", "game_sides.points"])}
+            FROM game_sides
+            {"LEFT JOIN stat_deltas ON stat_deltas.game_id = game_sides.game_id" if params else ""}
+            ORDER BY game_sides.game_id;'''
+        return query
+
+    def get_feature_matrix(self, start_year, end_year, params, after_game_id=0):
+        query = self.get_feature_query(params)
+        parameters = (start_year, end_year, after_game_id)
+        if params:
+            parameters = parameters + (FANTASY_SOURCE,) + parameters
+        rows = self.wrapper.fetch_all(query, parameters)
+        columns = ["game_id"] + list(params) + ["home", "away", "points"]
+        df = pd.DataFrame(rows, columns=columns)
+        df[list(params)] = df[list(params)].astype(float)
         return df
 
     def sm_to_json(self, model, model_name):
@@ -94,30 +92,15 @@ class Regression():
             json.dump(model_summary, f, indent=2)
 
 
-    def get_all_deltas(self, start_year, end_year, params):
+    def get_all_deltas(self, start_year, end_year, params, refresh=False):
         self.wrapper.connect()
-        df = pd.DataFrame(columns = ['game_id'])
-        for statistic in params[:]:
-            home_data = self.get_stat(statistic, start_year, end_year, True)
-            away_data = self.get_stat(statistic, start_year, end_year, False)
-            delta_frame = self.get_delta_frame(home_data, away_data, statistic)
-            df = df.merge(delta_frame, on=["game_id"], how="outer")
-
-        df = df.sort_values(by="game_id").reset_index(drop=True)
-        home_teams = list(zip(*self.get_teams(start_year, end_year, True)))[0]
-        away_teams = list(zip(*self.get_teams(start_year, end_year, False)))[0]
-        df['home'] = home_teams
-        df['away'] = away_teams
-
-        home_points = self.get_points(start_year, end_year, True)
-        away_points = self.get_points(start_year, end_year, False)
-        points_df = self.get_delta_frame(home_points, away_points, "points")
-        df = df.merge(points_df, on=["game_id"], how="outer")
-        df=df.fillna(0)
+        self.stats_table = PlayerGameStats(self.wrapper)
+        build = lambda after_game_id: self.get_feature_matrix(start_year, end_year, params, after_game_id)
+        df = self.feature_store.get(start_year, end_year, params, build, refresh)
         self.wrapper.close()
         return df
 
-    def deltas(self, start_year, end_year):
+    def deltas(self, start_year, end_year, refresh=False):
         params =[
                 "forced_drop_outs",
                 "kick_meters",
@@ -125,7 +108,7 @@ class Regression():
                 "meters_gained",
                 ]
 
-        df = self.get_all_deltas(start_year, end_year, params)
+        df = self.get_all_deltas(start_year, end_year, params, refresh)
         #df["const"] = 1
         train = df.iloc[:-80]   # First 700 rows for training
         test = df.iloc[-80:]    # Remaining rows for testing
@@ -160,7 +143,8 @@ if __name__ == "__main__":
     start_year = int(sys.argv[1])
     end_year = int(sys.argv[2])
     r = Regression()
-    r.deltas(start_year,end_year)
+    # --refresh rebuilds the cached features, e.g. after scores were corrected in place
+    r.deltas(start_year,end_year, refresh="--refresh" in sys.argv)
 
 
 
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+
+""" On disk cache of the regression feature matrix, one .npz per (start year, end year, stats, schema
+version). Every load writes new player_performance rows, so the highest game and performance ids are
+the ingest watermark: when they match the cache is used as is, when only games above the cached max
+game id were added just those are built and appended, anything else rebuilds the matrix. Edits made in
+place outside the importers (e.g. scores corrected by assess_winners) need refresh=True."""
+
+FEATURE_SCHEMA_VERSION = 2
+
+class FeatureStore():
+    def __init__(self, wrapper, folder="/home/paul/Projects/NRLAnalysis/features"):
+        self.wrapper = wrapper
+        self.folder = folder
+
+    def get_path(self, start_year, end_year, params):
+        key = json.dumps([FEATURE_SCHEMA_VERSION, int(start_year), int(end_year), list(params)])
+        return os.path.join(self.folder, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".npz")
+
+    def get_watermark(self):
+        max_game_id = self.wrapper.fetch_one("SELECT COALESCE(MAX(id), 0) FROM games;")[0]
+        max_performance_id = self.wrapper.fetch_one("SELECT COALESCE(MAX(id), 0) FROM player_performance;")[0]
+        return max_game_id, max_performance_id
+
+    def is_appendable(self, start_year, end_year, watermark, row_count):
+        """
+        True when none of the cached games were deleted or had performances reloaded.
+        """
+        max_game_id, max_performance_id = watermark
+        query = """SELECT COUNT(DISTINCT game_teams.game_id) FROM games
+                JOIN game_teams ON game_teams.game_id = games.id
+                WHERE games.year >= ? AND games.year <= ? AND games.id <= ?;"""
+        if self.wrapper.fetch_one(query, (start_year, end_year, max_game_id))[0] != row_count:
+            return False
+        query = "SELECT COALESCE(MAX(id), 0) FROM player_performance WHERE game_id <= ?;"
+        return self.wrapper.fetch_one(query, (max_game_id,))[0] <= max_performance_id
+
+    def load(self, path, params):
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                df = pd.DataFrame(data["features"], columns=list(params))
+                df.insert(0, "game_id", data["game_id"])
+                df["home"] = data["home"]
+                df["away"] = data["away"]
+                df["points"] = data["points"]
+                return df, tuple(data["watermark"].tolist())
+        except (FileNotFoundError, ValueError, KeyError):
+            return None, None
+
+    def save(self, path, df, params, watermark):
+        os.makedirs(self.folder, exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "wb") as f:
+            np.savez(
+                    f,
+                    game_id=df["game_id"].to_numpy(dtype=np.int64),
+                    features=df[list(params)].to_numpy(dtype=np.float64).reshape(len(df), len(params)),
+                    home=df["home"].to_numpy(dtype=str),
+                    away=df["away"].to_numpy(dtype=str),
+                    points=df["points"].to_numpy(dtype=np.int64),
+                    watermark=np.array(watermark, dtype=np.int64))
+        os.replace(temp_path, path)
+
+    def get(self, start_year, end_year, params, build, refresh=False):
+        """
+        Returns the feature matrix, build(after_game_id) returns the rows of the games with a
+        greater id straight from the database.
+        """
+        path = self.get_path(start_year, end_year, params)
+        watermark = self.get_watermark()
+        df, cached_watermark = (None, None) if refresh else self.load(path, params)
+        if df is not None and cached_watermark == watermark:
+            print("INFO", f"Features loaded from {path}")
+            return df
+        if df is not None and self.is_appendable(start_year, end_year, cached_watermark, len(df)):
+            new_rows = build(cached_watermark[0])
+            print("INFO", f"Appending {len(new_rows)} games to {path}")
+            df = pd.concat([df, new_rows], ignore_index=True) if len(new_rows) else df
+        else:
+            df = build(0)
+        self.save(path, df, params, watermark)
+        return df
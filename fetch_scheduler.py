@@ -0,0 +1,99 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+class TokenBucket():
+    """
+    Allows `rate` requests per second on average with bursts of up to `capacity` requests.
+    Thread safe, acquire() blocks until a token is available.
+    """
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class FetchScheduler():
+    """
+    Runs fetches on a bounded thread pool while keeping every host inside its own token bucket
+    rate limit. Failed fetches are retried with exponential backoff and full jitter.
+
+    Attributes:
+        fetch: callable
+            Takes a url and returns the parsed result, raises on any failure.
+        requests_per_second: float
+            Average request rate allowed per host.
+        burst: int
+            Number of requests a host may receive back to back.
+        max_in_flight: int
+            Maximum number of concurrent requests across all hosts.
+        retries: int
+            Attempts per url before the error is raised to the caller.
+        backoff: float
+            Base delay in seconds, doubled after each failed attempt up to max_backoff.
+        is_cached: callable
+            Optional, takes a url and returns True when the fetch will not touch the network.
+            Those fetches skip the rate limit.
+    """
+    def __init__(self, fetch, requests_per_second=0.2, burst=1, max_in_flight=4, retries=3, backoff=5, max_backoff=120, is_cached=None):
+        self.fetch = fetch
+        self.is_cached = is_cached
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.buckets = {}
+        self.buckets_lock = threading.Lock()
+
+    def get_bucket(self, url):
+        host = urlparse(url).netloc
+        with self.buckets_lock:
+            if host not in self.buckets:
+                self.buckets[host] = TokenBucket(self.requests_per_second, self.burst)
+            return self.buckets[host]
+
+    def fetch_with_retries(self, url):
+        bucket = self.get_bucket(url)
+        for attempt in range(1, self.retries + 1):
+            if self.is_cached is None or not self.is_cached(url):
+                bucket.acquire()
+            try:
+                return self.fetch(url)
+            except Exception as e:
+                print(f"Attempt {attempt}: {url} failed: {e}")
+                if attempt == self.retries:
+                    raise Exception(f"Failed to fetch data from {url} after {self.retries} retries") from e
+            delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+            time.sleep(random.uniform(0, delay))
+
+    def map(self, urls):
+        """
+        Fetches every url concurrently and yields the results in the order of urls, so callers can
+        save each result as soon as it and everything before it has arrived.
+        """
+        pool = ThreadPoolExecutor(max_workers=self.max_in_flight)
+        try:
+            futures = [pool.submit(self.fetch_with_retries, x) for x in urls]
+            for future in futures:
+                yield future.result()
+        finally:
+            # drop the queued fetches if the caller stops early
+            pool.shutdown(wait=True, cancel_futures=True)
@@ -1,59 +1,74 @@
-import requests
 import time
 import json
 import os
 import shutil
+from http_client import HTTPClient, ResponseCache
+from archive import JSONArchive
 
 class Scraper():
-    def __init__(self, get_schedule=False):
+    def __init__(self, get_schedule=False, offline=False):
         self.is_get_schedule = get_schedule
         self.crawl_delay = 5
-        self.retries = 30
+        # retried by the client with exponential backoff, never less than crawl_delay apart
+        self.retries = 6
         self.last_request = time.time() - self.crawl_delay
         self.base_folder = "/home/paul/Projects/NRLAnalysis/"
         self.completed_folder = "/fantasymatches/Completed/"
         self.scheduled_folder = "/fantasymatches/Scheduled/"
+        # completed matches are appended to a per season archive instead of a file each
+        self.archive = JSONArchive(self.base_folder + "fantasymatches/archive/")
         self.base_api_url = "https://www.nrlfantasystats.com/includes/"
-
-    def get_data(self, extension, data):
-        current_time = time.time()
-        delay = max(self.crawl_delay - (current_time - self.last_request), 0)
-        time.sleep(delay)
-        self.last_request = time.time()
-        url = self.base_api_url + extension + ".php"
-        print(url, data)
         headers = {
             "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:135.0) Gecko/20100101 Firefox/135.0",
             "Accept": "*/*",
             "Accept-Language": "en-US,en;q=0.5",
-            "Accept-Encoding": "gzip, deflate, br, zstd",
             "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
             "X-Requested-With": "XMLHttpRequest",
             "Origin": "https://www.nrlfantasystats.com",
             "DNT": "1",
             "Sec-GPC": "1",
             "Referer": "https://www.nrlfantasystats.com/matches.php?m=1111050&year=2025",
-            "Connection": "keep-alive",
             "Sec-Fetch-Dest": "empty",
             "Sec-Fetch-Mode": "cors",
             "Sec-Fetch-Site": "same-origin",
             "TE": "trailers"
         }
-         
-        for _ in range(self.retries):
-            response = requests.post(url, headers=headers, data=data)
-            if response.status_code == 200:
-                try:
-                    # Attempt to parse JSON
-                    json_data = response.json()
-                    return(json_data)
-                except ValueError as e:
-                    print("Response is not JSON. Here's the raw text:")
-                    print(response.text)
-            else:
-                print(f"Request failed with status code {response.status_code}")
-                time.sleep(self.crawl_delay)
-        raise Exception("Failed to post request {data}")
+        # completed matches are pinned in get_match and never refetched
+        cache = ResponseCache(
+                self.base_folder + "cache/fantasy",
+                ttl_rules=[(r"get_rounds", 86400)],
+                default_ttl=3600,
+                offline=offline)
+        self.client = HTTPClient(headers=headers, retries=self.retries, backoff=self.crawl_delay, min_backoff=self.crawl_delay, cache=cache)
+        self.get_saved_matches()
+
+    def get_saved_matches(self):
+        # listed once per run and kept up to date by get_match
+        self.saved_matches = set([x.replace('.json','') for x in os.listdir(self.base_folder + self.completed_folder)])
+        self.saved_matches |= set([x.replace('.json','') for x in self.archive.get_names()])
+        if self.is_get_schedule:
+            self.saved_matches |= set([x.replace('.json','') for x in os.listdir(self.base_folder + self.scheduled_folder)])
+
+    def get_url(self, extension):
+        return self.base_api_url + extension + ".php"
+
+    def get_data(self, extension, data):
+        url = self.get_url(extension)
+        if not self.client.is_cached(url, "POST", data):
+            current_time = time.time()
+            delay = max(self.crawl_delay - (current_time - self.last_request), 0)
+            time.sleep(delay)
+            self.last_request = time.time()
+        print(url, data)
+        response = self.client.post(url, data=data)
+        if response.status_code != 200:
+            raise Exception(f"Failed to post request {data}, status code {response.status_code}")
+        try:
+            return response.json()
+        except ValueError as e:
+            print("Response is not JSON. Here's the raw text:")
+            print(response.text)
+            raise Exception(f"Failed to post request {data}") from e
 
     def get_match(self, year, match_id):
         payload = {"match_id":match_id, "year":year}
@@ -62,24 +77,20 @@ class Scraper():
         if game_data["match_info"]["status"] != "complete" and not self.is_get_schedule:
             exit()
     
+        filename = f"{year}_{match_id}.json"
         if game_data["match_info"]["status"] == "complete":
-            subfolder = self.completed_folder
+            self.client.pin(self.get_url("get_match_data"), "POST", payload)
+            self.archive.append(year, filename, game_data)
         else:
-            subfolder = self.scheduled_folder
-    
-        filename = f"{year}_{match_id}.json"
-        with open(self.base_folder + subfolder + filename, "w") as f:
-            json.dump(game_data, f, indent=2)
+            with open(self.base_folder + self.scheduled_folder + filename, "w") as f:
+                json.dump(game_data, f, indent=2)
+        self.saved_matches.add(f"{year}_{match_id}")
     
     def get_matches(self, year, rnd):
-        saved_matches = [x.replace('.json','') for x in os.listdir(self.base_folder + self.completed_folder)]
-        if self.is_get_schedule:
-            saved_matches += [x.replace('.json','') for x in os.listdir(self.base_folder + self.scheduled_folder)]
-    
         payload = {"round":rnd, "year":year}
         matches = self.get_data("get_matches", payload)
         for index, m in enumerate(matches):
-            if f"{year}_{m['id']}" in saved_matches:
+            if f"{year}_{m['id']}" in self.saved_matches:
                 continue
             print(f"Getting {year} round:{rnd} match:{index + 1}")
             self.get_match(year, m['id'])
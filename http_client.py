@@ -0,0 +1,249 @@
+import random
+import time
+import hashlib
+import json
+import os
+import re
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+
+class CachedResponse():
+    """
+    The parts of a requests Response the scrapers use, rebuilt from the cache.
+    """
+    def __init__(self, url, status_code, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.from_cache = True
+
+    @property
+    def text(self):
+        charset = re.search(r"charset=([\w-]+)", self.headers.get("Content-Type", ""))
+        return self.content.decode(charset.group(1) if charset else "utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class ResponseCache():
+    """
+    On disk cache of successful responses keyed by method, url and payload. Entries keep their
+    ETag/Last-Modified so expired entries are revalidated with a conditional request, and a 304
+    costs no body transfer.
+
+    Attributes:
+        folder: str
+            Directory holding a .json metadata file and a .body file per entry.
+        ttl_rules: list
+            (regex, seconds) pairs checked in order against the url, the first match sets how long
+            a new entry is fresh. None means the entry never expires.
+        default_ttl: int
+            Seconds an entry is fresh when no rule matches.
+        offline: bool
+            Serve every request from the cache whatever its age and never touch the network.
+    """
+    def __init__(self, folder, ttl_rules=(), default_ttl=3600, offline=False):
+        self.folder = folder
+        self.ttl_rules = [(re.compile(x[0]), x[1]) for x in ttl_rules]
+        self.default_ttl = default_ttl
+        self.offline = offline
+        os.makedirs(folder, exist_ok=True)
+
+    def get_key(self, method, url, data=None):
+        payload = json.dumps(data, sort_keys=True, default=str) if data else ""
+        return hashlib.sha1(f"{method} {url} {payload}".encode("utf-8")).hexdigest()
+
+    def get_paths(self, key):
+        return os.path.join(self.folder, key + ".json"), os.path.join(self.folder, key + ".body")
+
+    def get_ttl(self, url):
+        for pattern, ttl in self.ttl_rules:
+            if pattern.search(url):
+                return ttl
+        return self.default_ttl
+
+    def load(self, key, with_content=True):
+        meta_path, body_path = self.get_paths(key)
+        try:
+            with open(meta_path, "r") as f:
+                entry = json.load(f)
+            if with_content:
+                with open(body_path, "rb") as f:
+                    entry["content"] = f.read()
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return entry
+
+    def write_file(self, path, data, mode):
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, mode) as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def save_entry(self, key, entry):
+        meta_path, body_path = self.get_paths(key)
+        meta = {x:entry[x] for x in entry if x != "content"}
+        if "content" in entry:
+            self.write_file(body_path, entry["content"], "wb")
+        self.write_file(meta_path, json.dumps(meta), "w")
+
+    def is_fresh(self, entry):
+        if entry is None:
+            return False
+        if self.offline or entry["ttl"] is None:
+            return True
+        return time.time() - entry["stored_at"] < entry["ttl"]
+
+    def store(self, key, url, response):
+        headers = {x:response.headers[x] for x in ("ETag", "Last-Modified", "Content-Type") if x in response.headers}
+        entry = {
+                "url": url,
+                "status_code": response.status_code,
+                "headers": headers,
+                "stored_at": time.time(),
+                "ttl": self.get_ttl(url),
+                "content": response.content}
+        self.save_entry(key, entry)
+
+    def refresh(self, key, entry):
+        entry["stored_at"] = time.time()
+        self.save_entry(key, {x:entry[x] for x in entry if x != "content"})
+
+    def pin(self, key):
+        """
+        Marks an entry as never expiring, e.g. once the page is known to be a completed match.
+        """
+        entry = self.load(key, with_content=False)
+        if entry is None or entry["ttl"] is None:
+            return
+        entry["ttl"] = None
+        self.save_entry(key, entry)
+
+    def get_response(self, entry):
+        return CachedResponse(entry["url"], entry["status_code"], entry["headers"], entry["content"])
+
+    def get_validators(self, entry):
+        headers = {}
+        if "ETag" in entry["headers"]:
+            headers["If-None-Match"] = entry["headers"]["ETag"]
+        if "Last-Modified" in entry["headers"]:
+            headers["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+        return headers
+
+
+class HTTPClient():
+    """
+    Shared HTTP layer for the scrapers. Keeps one session per client so connections are reused
+    (keep-alive) instead of paying a TCP and TLS handshake on every request, advertises only the
+    content encodings that can be decoded locally and applies one retry policy.
+
+    Attributes:
+        headers: dict
+            Headers sent with every request, per request headers are merged over them.
+        retries: int
+            Extra attempts after a connection error or a status in retry_statuses. Use 0 when the
+            caller already retries, e.g. through a FetchScheduler.
+        backoff: float
+            Base delay in seconds, doubled after each attempt up to max_backoff, with full jitter.
+            A numeric Retry-After header takes precedence.
+        min_backoff: float
+            Shortest delay between attempts, e.g. a scraper's crawl delay.
+        impersonate: str
+            Browser to impersonate through curl_cffi (e.g. "chrome"), None uses requests.
+        cache: ResponseCache
+            Optional response cache, None always goes to the network.
+    """
+    def __init__(self, headers=None, retries=3, backoff=5, max_backoff=120, min_backoff=0, retry_statuses=(429, 500, 502, 503, 504), timeout=30, pool_size=10, impersonate=None, cache=None):
+        self.cache = cache
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.min_backoff = min_backoff
+        self.retry_statuses = retry_statuses
+        self.timeout = timeout
+        self.impersonate = impersonate
+        if impersonate:
+            from curl_cffi import requests as curl_requests
+            self.session = curl_requests.Session(impersonate=impersonate)
+            self.request_errors = (curl_requests.RequestsError,)
+        else:
+            self.session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            self.session.mount("https://", adapter)
+            self.session.mount("http://", adapter)
+            self.request_errors = (requests.RequestException,)
+        self.session.headers.update(headers or {})
+        if not impersonate:
+            # gzip/deflate always, br and zstd only when brotli/zstandard are installed
+            self.session.headers["Accept-Encoding"] = ACCEPT_ENCODING
+
+    def get_delay(self, attempt, response):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return max(self.min_backoff, min(self.max_backoff, int(retry_after)))
+        return random.uniform(self.min_backoff, max(self.min_backoff, min(self.max_backoff, self.backoff * 2 ** attempt)))
+
+    def is_cached(self, url, method="GET", data=None):
+        """
+        True when the request would be answered from the cache without a network round trip.
+        """
+        if self.cache is None:
+            return False
+        return self.cache.is_fresh(self.cache.load(self.cache.get_key(method, url, data), with_content=False))
+
+    def pin(self, url, method="GET", data=None):
+        if self.cache is not None:
+            self.cache.pin(self.cache.get_key(method, url, data))
+
+    def request(self, method, url, **kwargs):
+        if self.cache is None:
+            return self.send(method, url, **kwargs)
+
+        key = self.cache.get_key(method, url, kwargs.get("data"))
+        entry = self.cache.load(key)
+        if self.cache.is_fresh(entry):
+            return self.cache.get_response(entry)
+        if self.cache.offline:
+            raise requests.RequestException(f"{url} is not cached and the client is offline")
+
+        if entry is not None:
+            headers = dict(kwargs.pop("headers", None) or {})
+            headers.update(self.cache.get_validators(entry))
+            kwargs["headers"] = headers
+        response = self.send(method, url, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            self.cache.refresh(key, entry)
+            return self.cache.get_response(entry)
+        if response.status_code == 200:
+            self.cache.store(key, url, response)
+        return response
+
+    def send(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        for attempt in range(self.retries + 1):
+            response = None
+            try:
+                response = self.session.request(method, url, **kwargs)
+                if response.status_code not in self.retry_statuses:
+                    return response
+                print(f"Attempt {attempt + 1}: Received status code {response.status_code} from {url}")
+            except self.request_errors as e:
+                print(f"Attempt {attempt + 1}: Request to {url} failed: {e}")
+                if attempt == self.retries:
+                    raise
+            if attempt < self.retries:
+                time.sleep(self.get_delay(attempt, response))
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request("POST", url, data=data, **kwargs)
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,11 @@
+-- Secondary indexes for the analytical queries. These are kept out of
+-- schema.sql so a full reload can drop them and build them once at the end
+-- (see SQLiteWrapper.drop_indexes / create_indexes).
+
+-- Regression year range filters and joins
+CREATE INDEX IF NOT EXISTS idx_games_year ON games(year, id);
+CREATE INDEX IF NOT EXISTS idx_game_teams_home ON game_teams(is_home_team, game_id, team_id, score);
+
+-- load_nrl_data_to_db get_player_performances and games -> performance joins
+CREATE INDEX IF NOT EXISTS idx_player_performance_game_team ON player_performance(game_id, team_id);
+CREATE INDEX IF NOT EXISTS idx_player_performance_player ON player_performance(player_id);
@@ -0,0 +1,73 @@
+import hashlib
+import os
+
+""" Shared record of which source files have been loaded into the database. Each loader keeps its own
+source name. A file is skipped when its size and mtime match the manifest, only files whose size or
+mtime changed are hashed, and a matching hash means the file was touched but not changed. Files recorded
+as invalid are skipped the same way until they change. Records read from a JSONArchive are tracked under
+"archive_path:name" with the hash kept in the archive index."""
+
+LOADED = "loaded"
+# unreadable or incomplete, retried once the file changes or its manifest row is deleted
+INVALID = "invalid"
+
+def get_file_hash(filepath):
+    with open(filepath, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+class IngestManifest():
+    def __init__(self, wrapper, source):
+        self.wrapper = wrapper
+        self.source = source
+        self.get_entries()
+
+    def get_entries(self):
+        query = "SELECT file_path, size, mtime, hash, status FROM ingest_manifest WHERE source = ?;"
+        rows = self.wrapper.fetch_all(query, (self.source,))
+        self.entries = {x[0]:x[1:] for x in rows}
+
+    def is_known(self, filepath):
+        return filepath in self.entries
+
+    def is_current(self, filepath):
+        """
+        True when the file is unchanged since it was recorded, whether it was loaded or invalid.
+        """
+        entry = self.entries.get(filepath)
+        if entry is None:
+            return False
+        stat = os.stat(filepath)
+        if (stat.st_size, stat.st_mtime) == (entry[0], entry[1]):
+            return True
+        if stat.st_size != entry[0]:
+            return False
+        if get_file_hash(filepath) != entry[2]:
+            return False
+        self.record(filepath, entry[3], entry[2])
+        return True
+
+    def is_current_record(self, key, record_hash):
+        entry = self.entries.get(key)
+        return entry is not None and entry[2] == record_hash
+
+    def record(self, filepath, status=LOADED, file_hash=None):
+        stat = os.stat(filepath)
+        if file_hash is None:
+            file_hash = get_file_hash(filepath)
+        self.save_entry(filepath, stat.st_size, stat.st_mtime, file_hash, status)
+
+    def record_archived(self, key, size, record_hash, status=LOADED):
+        self.save_entry(key, size, 0, record_hash, status)
+
+    def save_entry(self, filepath, size, mtime, file_hash, status):
+        query = """INSERT INTO ingest_manifest (source, file_path, size, mtime, hash, status, loaded_at)
+                VALUES (?, ?, ?, ?, ?, ?, datetime('now'))
+                ON CONFLICT(source, file_path) DO UPDATE SET
+                    size = excluded.size,
+                    mtime = excluded.mtime,
+                    hash = excluded.hash,
+                    status = excluded.status,
+                    loaded_at = excluded.loaded_at;"""
+        parameters = (self.source, filepath, size, mtime, file_hash, status)
+        self.wrapper.execute_query(query, parameters)
+        self.entries[filepath] = (size, mtime, file_hash, status)
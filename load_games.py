@@ -1,22 +1,128 @@
 from sqlite_wrapper import SQLiteWrapper
+from player_game_stats import PlayerGameStats, FANTASY_SOURCE
 import json
 import os
-from geopy.distance import geodesic
+import hashlib
+from multiprocessing import Pool
+from travel_distances import TravelDistances
+from ingest_manifest import IngestManifest, LOADED, INVALID
+from archive import JSONArchive, load_record
+
+PERFORMANCE_GLOSSARY = {
+  "T": "tries",
+  "TS": "tries_saved",
+  "G": "goals",
+  "FG": "field_goals",
+  "TA": "try_assists",
+  "LB": "line_breaks",
+  "LBA": "line_break_assists",
+  "TCK": "tackles",
+  "TB": "tackle_breaks",
+  "MT": "missed_tackles",
+  "OF": "offloads",
+  "ER": "errors",
+  "FT": "forty_twenty",
+  "FTO": "forced_turnover",
+  "MG": "meters_gained",
+  "KM": "kick_meters",
+  "KD": "kicks_defused",
+  "PC": "penalties_conceded",
+  "SB": "sin_bins",
+  "SO": "send_off",
+  "TOG": "minutes_played",
+  "FDO": "forced_drop_outs",
+  "OFH": "offloads_to_hand",
+  "OFG": "offloads_to_ground",
+  "SAI": "six_again_infringement",
+  "EFIG": "escape_ingoal",
+  "FP": "fantasy_points"
+}
+
+def get_comp_points(home_score, away_score):
+    if home_score > away_score:
+        return 2, 0
+    elif away_score > home_score:
+        return 0, 2
+    return 1, 1
+
+def parse_performance(performance):
+    stats = {}
+    for key, stat_type in PERFORMANCE_GLOSSARY.items():
+        count = int(performance.get(key, 0))
+        if count:
+            stats[stat_type] = count
+    return (
+            int(performance["player_id"]),
+            performance["first_name"],
+            performance["last_name"],
+            int(performance["squad_id"]),
+            performance["position_match"],
+            stats)
+
+def parse_game(source):
+    """
+    Reads and normalises one fantasy match into plain tuples. source is (filepath, None) for a
+    match file or (record key, raw record) for a match read from the archive. Runs in a worker
+    process so it must not touch the database, ff ids are mapped by the writer. A malformed match
+    returns None for everything but the filepath and hash.
+    """
+    filepath, raw_data = source
+    load = load_record
+    if raw_data is None:
+        with open(filepath,"rb") as f:
+            raw_data = f.read()
+        load = json.loads
+    file_hash = hashlib.sha1(raw_data).hexdigest()
+    try:
+        return (filepath, file_hash) + parse_game_data(load(raw_data))
+    except (ValueError, KeyError, TypeError) as e:
+        print("ERROR", f"{filepath} could not be parsed: {e!r}")
+        return filepath, file_hash, None, None, None, None
+
+def parse_game_data(game_data):
+    match_info = game_data["match_info"]
+    date, time = tuple(match_info["match_date"].split())
+    game_parameters = (
+            int(match_info["round"]),
+            int(match_info["year"]),
+            date,
+            time,
+            match_info["match_id"],
+            int(match_info["venue_id"]),
+            match_info["status"] == "complete",
+            match_info["weather"],
+            int(match_info["id"]))
+    home_score = int(match_info["home_score"])
+    away_score = int(match_info["away_score"])
+    team_data = (
+            int(match_info["home_squad_id"]),
+            int(match_info["away_squad_id"]),
+            home_score,
+            away_score) + get_comp_points(home_score, away_score)
+    home_team_players = [parse_performance(x) for x in game_data["home_squad"]]
+    away_team_players = [parse_performance(x) for x in game_data["away_squad"]]
+    return game_parameters, team_data, home_team_players, away_team_players
 
 class Importer():
-    def __init__(self):
-        self.wrapper = SQLiteWrapper(db_name = "/home/paul/Projects/NRLAnalysis/database.db")
+    def __init__(self, workers=None):
+        self.workers = workers
+        self.wrapper = SQLiteWrapper(db_name = "/home/paul/Projects/NRLAnalysis/database.db", profile = "bulk-load")
         self.wrapper.connect()
+        self.stats_table = PlayerGameStats(self.wrapper)
         self.get_venues()
         self.get_teams()
+        self.distances = TravelDistances(self.wrapper)
         self.players = self.get_id_dict("ff_player_id", "id", "players")
+        self.manifest = IngestManifest(self.wrapper, FANTASY_SOURCE)
         self.get_loaded_games()
         self.load_all_games()
 
     def get_loaded_games(self):
-        query = "SELECT year, ff_game_id FROM games;"
+        # every game row, including those the nrl.com importer created, and the games with fantasy data
+        query = "SELECT year, ff_game_id, id, fantasy_stats_loaded FROM games;"
         games = self.wrapper.fetch_all(query)
-        self.loaded_games = set([f"{x[0]}_{x[1]}.json" for x in games])
+        self.loaded_games = {f"{x[0]}_{x[1]}.json":x[2] for x in games}
+        self.fantasy_loaded_games = {f"{x[0]}_{x[1]}.json" for x in games if x[3]}
 
     def get_id_dict(self, id_name, key_column_name, table):
         dictionary = {}
@@ -51,148 +157,179 @@ class Importer():
 
 
     
-    def create_player(self, performance):
-        ff_player_id = int(performance["player_id"])
+    def create_player(self, ff_player_id, first_name, last_name):
         query = "INSERT INTO players (ff_player_id, first_name, last_name) VALUES (?, ?, ?);"
-        parameters = (
-                ff_player_id, 
-                performance["first_name"], 
-                performance["last_name"])
-        self.wrapper.execute_query(query, parameters)
-        player_id = self.wrapper.get_max_index("players")
+        parameters = (ff_player_id, first_name, last_name)
+        player_id = self.wrapper.insert(query, parameters)
         self.players[ff_player_id] = player_id
         return player_id
 
 
-    def load_performance(self, game_id, performance, performance_headers, details, start_performance_id, is_home):
-        performance_glossary = {
-          "T": "tries",
-          "TS": "tries_saved",
-          "G": "goals",
-          "FG": "field_goals",
-          "TA": "try_assists",
-          "LB": "line_breaks",
-          "LBA": "line_break_assists",
-          "TCK": "tackles",
-          "TB": "tackle_breaks",
-          "MT": "missed_tackles",
-          "OF": "offloads",
-          "ER": "errors",
-          "FT": "forty_twenty",
-          "FTO": "forced_turnover",
-          "MG": "meters_gained",
-          "KM": "kick_meters",
-          "KD": "kicks_defused",
-          "PC": "penalties_conceded",
-          "SB": "sin_bins",
-          "SO": "send_off",
-          "TOG": "minutes_played",
-          "FDO": "forced_drop_outs",
-          "OFH": "offloads_to_hand",
-          "OFG": "offloads_to_ground",
-          "SAI": "six_again_infringement",
-          "EFIG": "escape_ingoal",
-          "FP": "fantasy_points"
-        }
-        player_id = self.players.get(int(performance["player_id"]))
-        if player_id is None:
-            player_id = self.create_player(performance)
-        team_id = self.teams_ff_key.get(int(performance['squad_id']))
-        position = performance["position_match"]
-        performance_headers.append((game_id, team_id, player_id, position))
-        for key, stat_type in performance_glossary.items():
-            count = int(performance.get(key, 0))
-            if count:
-                details.append((start_performance_id + len(performance_headers), stat_type, count, is_home))
-
-
     def load_performances(self, game_id, performances, is_home):
         performance_headers = [] 
         details = []
-        player_performance_id = self.wrapper.get_max_index("player_performance")
-        if player_performance_id is None:
-            player_performance_id = 0
 
-        for performance in performances:
-            self.load_performance(game_id, performance, performance_headers, details, player_performance_id, is_home)
+        for ff_player_id, first_name, last_name, ff_squad_id, position, stats in performances:
+            player_id = self.players.get(ff_player_id)
+            if player_id is None:
+                player_id = self.create_player(ff_player_id, first_name, last_name)
+            team_id = self.teams_ff_key.get(ff_squad_id)
+            performance_headers.append((game_id, team_id, player_id, position, FANTASY_SOURCE))
+            details.append(stats)
+
+        query = "INSERT INTO player_performance (game_id, team_id, player_id, position, source) VALUES (?, ?, ?, ?, ?);"
+        performance_ids = self.wrapper.insert_many(query, performance_headers)
+        rows = [(performance_id, is_home, stats) for performance_id, stats in zip(performance_ids, details)]
+        self.stats_table.write(rows)
+
+
+    def get_changed_files(self, folder, archived_names=()):
+        """
+        Matches that are also in the archive are left to get_changed_records, a loose file is kept
+        after packing unless archive.py is run with --remove.
+        """
+        filepaths = []
+        with self.wrapper.transaction():
+            for file in sorted(os.listdir(folder)):
+                if file in archived_names:
+                    continue
+                filepath = folder + file
+                if self.manifest.is_current(filepath):
+                    continue
+                if file in self.fantasy_loaded_games and not self.manifest.is_known(filepath):
+                    # loaded before the manifest existed
+                    self.manifest.record(filepath)
+                    continue
+                filepaths.append(filepath)
+        return filepaths
 
-        query = "INSERT INTO player_performance (game_id, team_id, player_id, position) VALUES (?, ?, ?, ?);"
-        self.wrapper.execute_many(query, performance_headers)
-        query = f"INSERT INTO player_stats (player_performance_id, stat_type, count, is_home_team) VALUES (?, ?, ?, ?);"
-        self.wrapper.execute_many(query, details)
+    def get_changed_records(self, archive):
+        """
+        Returns {season: names} of archived matches to load and {record key: size}, using only the
+        archive indexes.
+        """
+        records = {}
+        sizes = {}
+        with self.wrapper.transaction():
+            for season in archive.get_seasons():
+                archive_path, _ = archive.get_paths(season)
+                for name, (offset, length, record_hash) in archive.get_index(season).items():
+                    key = f"{archive_path}:{name}"
+                    if self.manifest.is_current_record(key, record_hash):
+                        continue
+                    if name in self.fantasy_loaded_games and not self.manifest.is_known(key):
+                        # loaded from the loose file before it was packed
+                        self.manifest.record_archived(key, length, record_hash)
+                        continue
+                    records.setdefault(season, set()).add(name)
+                    sizes[key] = length
+        return records, sizes
 
+    def get_sources(self, filepaths, archive, records):
+        for filepath in filepaths:
+            yield filepath, None
+        for season, names in records.items():
+            archive_path, _ = archive.get_paths(season)
+            for name, raw_data, _ in archive.iter_raw(season):
+                if name in names:
+                    yield f"{archive_path}:{name}", raw_data
+
+    def clear_player_performances(self, game_id):
+        # only the fantasy rows, the nrl.com performances of the game are left as they are
+        performances = "SELECT id FROM player_performance WHERE game_id = ? AND source = ?"
+        parameters = (game_id, FANTASY_SOURCE)
+        self.wrapper.execute_query(f"DELETE FROM player_game_stats WHERE player_performance_id IN ({performances});", parameters)
+        self.wrapper.execute_query("DELETE FROM player_performance WHERE game_id = ? AND source = ?;", parameters)
+
+    def update_game(self, game_id, parameters):
+        query = """UPDATE games SET round = ?, year = ?, date = ?, time = ?, match_of_round = ?, venue_id = ?,
+                complete = ?, weather = ?, ff_game_id = ?, fantasy_stats_loaded = 1 WHERE id = ?;"""
+        self.wrapper.execute_query(query, list(parameters) + [game_id])
+        self.clear_player_performances(game_id)
+        return game_id
 
     def load_all_games(self):
         folder = "/home/paul/Projects/NRLAnalysis/fantasymatches/Completed/"
-        files = sorted(os.listdir(folder))
-        for file in files[:]:
-            print(file)
-            if file not in self.loaded_games:
-                self.load_game(folder + file)
+        archive = JSONArchive("/home/paul/Projects/NRLAnalysis/fantasymatches/archive/")
+        filepaths = self.get_changed_files(folder, archive.get_names())
+        records, archived_sizes = self.get_changed_records(archive)
+        print("INFO", f"{len(filepaths)} new or changed files, {len(archived_sizes)} new or changed archived matches")
+        if not filepaths and not archived_sizes:
+            # rebuilds indexes left dropped by a full reload that did not finish
+            self.wrapper.create_indexes()
+            return
+        # on a full reload build the indexes once at the end
+        if not self.loaded_games:
+            self.wrapper.drop_indexes()
+        try:
+            # worker processes parse the json while this process does all of the writes
+            with Pool(processes=self.workers) as pool:
+                with self.wrapper.transaction():
+                    sources = self.get_sources(filepaths, archive, records)
+                    for game in pool.imap(parse_game, sources, chunksize=8):
+                        print(game[0])
+                        # a game that fails is rolled back and logged, the others are still committed
+                        with self.wrapper.savepoint("game", on_error=self.reload_ids):
+                            status = LOADED if game[2] is not None else INVALID
+                            if status == LOADED:
+                                filename = os.path.basename(game[0].rsplit(":", 1)[-1])
+                                self.loaded_games[filename] = self.load_game(game, self.loaded_games.get(filename))
+                                self.fantasy_loaded_games.add(filename)
+                            if game[0] in archived_sizes:
+                                self.manifest.record_archived(game[0], archived_sizes[game[0]], game[1], status)
+                            else:
+                                self.manifest.record(game[0], status, game[1])
+        finally:
+            self.wrapper.create_indexes()
+        self.wrapper.print_statement_stats()
+
+    def reload_ids(self, error=None):
+        # players, games and stat columns created in a rolled back savepoint no longer exist
+        self.players = self.get_id_dict("ff_player_id", "id", "players")
+        self.get_loaded_games()
+        self.stats_table.get_columns()
 
     def calculate_distance(self, team_id, venue_id):
-        team_latitude = self.venues[self.teams[team_id]]["latitude"]
-        team_longitude = self.venues[self.teams[team_id]]["longitude"]
-        venue_latitude = self.venues[venue_id]["latitude"]
-        venue_longitude = self.venues[venue_id]["longitude"]
-        coords_1 = (team_latitude, team_longitude)
-        coords_2 = (venue_latitude, venue_longitude)
-        distance = geodesic(coords_1, coords_2).km
-        return distance
-
-    def load_game(self, filepath):
-        with open(filepath,"r") as f:
-            game_data = json.load(f)
-        match_info = game_data["match_info"]
-        home_team_players = game_data["home_squad"]
-        away_team_players = game_data["away_squad"]
-
-        parameters = []
-        parameters.append(int(match_info["round"]))
-        parameters.append(int(match_info["year"]))
-        date_time = (match_info["match_date"])
-        date, time = tuple(date_time.split())
-        venue_id = int(self.venues_ff_key[int(match_info["venue_id"])])
-        parameters.append(date)
-        parameters.append(time)
-        parameters.append(match_info["match_id"])
-        parameters.append(venue_id)
-        parameters.append((match_info["status"] == "complete"))
-        parameters.append(match_info["weather"])
-        parameters.append(int(match_info["id"]))
+        return self.distances.get_distance(team_id, venue_id)
+
+    def load_game(self, game, game_id=None):
+        """
+        Inserts the game, or updates it in place when game_id is the row of an earlier load of
+        either importer, so its id and nrl.com data are kept.
+        """
+        filepath, file_hash, game_parameters, team_data, home_team_players, away_team_players = game
+        ff_venue_id = game_parameters[5]
+        venue_id = int(self.venues_ff_key[ff_venue_id])
+        parameters = list(game_parameters)
+        parameters[5] = venue_id
         print(parameters)
-        query = "INSERT INTO games (round, year, date, time, match_of_round, venue_id, complete, weather, ff_game_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);"
-        self.wrapper.execute_query(query, parameters)
-        game_id = self.wrapper.get_max_index("games")
+        if game_id is None:
+            query = "INSERT INTO games (round, year, date, time, match_of_round, venue_id, complete, weather, ff_game_id, fantasy_stats_loaded) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 1);"
+            game_id = self.wrapper.insert(query, parameters)
+        else:
+            self.update_game(game_id, parameters)
 
-        home_team_ff_id = int(match_info["home_squad_id"])
-        away_team_ff_id = int(match_info["away_squad_id"])
+        home_team_ff_id, away_team_ff_id, home_score, away_score, home_comp_points, away_comp_points = team_data
         home_team_id = int(self.teams_ff_key[home_team_ff_id])
         away_team_id = int(self.teams_ff_key[away_team_ff_id])
-        home_score = int(match_info["home_score"])
-        away_score = int(match_info["away_score"])
-        home_comp_points = 0
-        away_comp_points = 0
-        if home_score > away_score:
-            home_comp_points = 2
-        elif away_score > home_score:
-            away_comp_points = 2
-        else:
-            away_comp_points = 1
-            away_comp_points = 1
 
         travel_distance_home = self.calculate_distance(home_team_id, venue_id)
         travel_distance_away = self.calculate_distance(away_team_id, venue_id)
-        query = "INSERT INTO game_teams (game_id, team_id, is_home_team, comp_points, score, conceded, travel_distance) VALUES (?, ?, ?, ?, ?, ?, ?);";
+        # win_odds of an existing row are kept
+        query = """INSERT INTO game_teams (game_id, team_id, is_home_team, comp_points, score, conceded, travel_distance) VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(game_id, team_id) DO UPDATE SET
+                    is_home_team = excluded.is_home_team,
+                    comp_points = excluded.comp_points,
+                    score = excluded.score,
+                    conceded = excluded.conceded,
+                    travel_distance = excluded.travel_distance;"""
         parameters_home = (game_id, home_team_id, True, home_comp_points, home_score, away_score, travel_distance_home)
         parameters_away = (game_id, away_team_id, False, away_comp_points, away_score, home_score, travel_distance_away)
-        self.wrapper.execute_query(query, parameters_home)
-        self.wrapper.execute_query(query, parameters_away)
+        self.wrapper.execute_many(query, [parameters_home, parameters_away])
         self.load_performances(game_id, home_team_players, True)
         self.load_performances(game_id, away_team_players, False)
-        
-imp = Importer()
-
+        return game_id
 
 
-        
+if __name__ == "__main__":
+    imp = Importer()
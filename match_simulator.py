@@ -0,0 +1,75 @@
+import numpy as np
+
+""" Monte Carlo match simulation drawn with numpy for every trial of every game at once. Each minute a
+team scores a try with probability p and converts it with probability c, so over a match the tries are
+Binomial(minutes, p) and the conversions Binomial(tries, c), the same distribution as simulating minute
+by minute. The distribution of a team's points is built once per team, simulate_margins draws each
+trial through its cdf and simulate_round draws only the counts of each outcome, so its cost does not
+grow with the number of trials."""
+
+def get_points_distribution(p, c, minutes=80):
+    """
+    Returns P(points == 2 * i) for i in 0..3 * minutes.
+    """
+    tries = np.array([1.0])
+    for _ in range(minutes):
+        tries = np.convolve(tries, [1 - p, p])
+    points = np.zeros(3 * minutes + 1)
+    conversions = np.array([1.0])
+    for no_tries in range(minutes + 1):
+        if no_tries:
+            conversions = np.convolve(conversions, [1 - c, c])
+        # a try is 4 points and a conversion 2, so 2 * no_tries + no_conversions in units of 2
+        points[2 * no_tries:3 * no_tries + 1] += tries[no_tries] * conversions
+    return points
+
+def draw_points(cdf, size, rng):
+    # rounding can leave the last cdf value just under 1
+    return np.minimum(np.searchsorted(cdf, rng.random(size), side="right"), len(cdf) - 1)
+
+def simulate_margins(p_home, p_away, c_home, c_away, trials, minutes=80, rng=None):
+    """
+    Returns the home minus away margin of every trial, shape (games, trials).
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    p_home, p_away, c_home, c_away = np.broadcast_arrays(*[np.atleast_1d(np.asarray(x, dtype=float)) for x in (p_home, p_away, c_home, c_away)])
+    home_cdfs = [np.cumsum(get_points_distribution(p, c, minutes)) for p, c in zip(p_home, c_home)]
+    away_cdfs = [np.cumsum(get_points_distribution(p, c, minutes)) for p, c in zip(p_away, c_away)]
+    margins = np.empty((len(p_home), trials), dtype=np.int64)
+    for game, (home_cdf, away_cdf) in enumerate(zip(home_cdfs, away_cdfs)):
+        margins[game] = 2 * (draw_points(home_cdf, trials, rng) - draw_points(away_cdf, trials, rng))
+    return margins
+
+def simulate_round(p_home, p_away, c_home=0.76, c_away=0.76, trials=10000, minutes=80, seed=None):
+    """
+    Simulates every game of a round. Parameters are per game arrays (or scalars for the
+    conversions), returns a dict of per game home_win, draw and away_win probabilities, the mean
+    margin, and margin_distribution[game, i], the probability of a margin of margins[i].
+    Only the outcome counts are drawn: the home points counts of all trials from one multinomial, then
+    the away points counts of the trials on each home score from another, which has the same
+    distribution as counting `trials` simulated matches.
+    """
+    rng = np.random.default_rng(seed)
+    p_home, p_away, c_home, c_away = np.broadcast_arrays(*[np.atleast_1d(np.asarray(x, dtype=float)) for x in (p_home, p_away, c_home, c_away)])
+    games = len(p_home)
+    max_margin = 6 * minutes
+    scores = np.arange(3 * minutes + 1)
+    # margin index of every (home points, away points) pair
+    margin_index = (2 * (scores[:, None] - scores[None, :]) + max_margin).ravel()
+    counts = np.zeros((games, 2 * max_margin + 1))
+    for game in range(games):
+        home_distribution = get_points_distribution(p_home[game], c_home[game], minutes)
+        away_distribution = get_points_distribution(p_away[game], c_away[game], minutes)
+        home_counts = rng.multinomial(trials, home_distribution / home_distribution.sum())
+        joint_counts = rng.multinomial(home_counts, away_distribution / away_distribution.sum())
+        counts[game] = np.bincount(margin_index, weights=joint_counts.ravel(), minlength=2 * max_margin + 1)
+
+    margins = np.arange(-max_margin, max_margin + 1)
+    distribution = counts / trials
+    return {
+            "home_win": distribution[:, margins > 0].sum(axis=1),
+            "draw": distribution[:, max_margin],
+            "away_win": distribution[:, margins < 0].sum(axis=1),
+            "mean_margin": distribution @ margins,
+            "margins": margins,
+            "margin_distribution": distribution}
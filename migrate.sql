@@ -0,0 +1,102 @@
+-- Brings a database created from an older schema.sql up to date.
+-- Fails on the unique indexes if duplicate rows have already been loaded.
+
+CREATE TABLE IF NOT EXISTS "player_game_stats"(
+    player_performance_id INTEGER PRIMARY KEY NOT NULL,
+    is_home_team BOOLEAN NOT NULL,
+    -- fantasy statistics, nrl.com statistics are added as REAL columns on first load
+    tries INTEGER,
+    tries_saved INTEGER,
+    goals INTEGER,
+    field_goals INTEGER,
+    try_assists INTEGER,
+    line_breaks INTEGER,
+    line_break_assists INTEGER,
+    tackles INTEGER,
+    tackle_breaks INTEGER,
+    missed_tackles INTEGER,
+    offloads INTEGER,
+    errors INTEGER,
+    forty_twenty INTEGER,
+    forced_turnover INTEGER,
+    meters_gained INTEGER,
+    kick_meters INTEGER,
+    kicks_defused INTEGER,
+    penalties_conceded INTEGER,
+    sin_bins INTEGER,
+    send_off INTEGER,
+    minutes_played INTEGER,
+    forced_drop_outs INTEGER,
+    offloads_to_hand INTEGER,
+    offloads_to_ground INTEGER,
+    six_again_infringement INTEGER,
+    escape_ingoal INTEGER,
+    fantasy_points INTEGER,
+    FOREIGN KEY(player_performance_id) REFERENCES player_performance(id)
+);
+
+CREATE TABLE IF NOT EXISTS "player_stats"(
+    id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    player_performance_id INTEGER NOT NULL,
+    stat_type VARCHAR(50) NOT NULL,
+    count INTEGER NOT NULL,
+    is_home_team BOOLEAN NOT NULL,
+    FOREIGN KEY(player_performance_id) REFERENCES player_performance(id)
+);
+
+CREATE TABLE IF NOT EXISTS "travel_distances"(
+    team_id INTEGER NOT NULL,
+    venue_id INTEGER NOT NULL,
+    distance REAL NOT NULL,
+    PRIMARY KEY (team_id, venue_id),
+    FOREIGN KEY(team_id) REFERENCES teams(id),
+    FOREIGN KEY(venue_id) REFERENCES venues(id)
+) WITHOUT ROWID;
+
+-- stale distances are deleted here and recomputed by travel_distances.py
+CREATE TRIGGER IF NOT EXISTS travel_distances_venue_moved
+AFTER UPDATE OF latitude, longitude ON venues
+BEGIN
+    DELETE FROM travel_distances
+    WHERE venue_id = NEW.id
+    OR team_id IN (SELECT id FROM teams WHERE home_venue_id = NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS travel_distances_home_changed
+AFTER UPDATE OF home_venue_id ON teams
+BEGIN
+    DELETE FROM travel_distances WHERE team_id = NEW.id;
+END;
+
+CREATE TABLE IF NOT EXISTS "ingest_manifest"(
+    source VARCHAR(30) NOT NULL,
+    file_path VARCHAR(255) NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    hash VARCHAR(40) NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    loaded_at VARCHAR(30),
+    PRIMARY KEY (source, file_path)
+) WITHOUT ROWID;
+
+-- fails harmlessly when the column already exists. nrl_ps still holds the nrl.com rows at this point,
+-- every other performance was written by the fantasy importer
+ALTER TABLE player_performance ADD COLUMN source VARCHAR(20) NOT NULL DEFAULT 'fantasy';
+UPDATE player_performance SET source = 'nrlstats' WHERE id IN (SELECT player_performance_id FROM nrl_ps);
+
+-- each importer skips the games it has loaded, not every game with a row
+ALTER TABLE games ADD COLUMN fantasy_stats_loaded BOOL NOT NULL DEFAULT 0;
+UPDATE games SET fantasy_stats_loaded = 1 WHERE id IN (SELECT game_id FROM player_performance WHERE source = 'fantasy');
+UPDATE games SET nrl_stats_loaded = 1 WHERE id IN (SELECT game_id FROM player_performance WHERE source = 'nrlstats');
+
+-- incremental job progress, e.g. the highest player_performance id assess_winners has checked
+CREATE TABLE IF NOT EXISTS "watermarks"(
+    name VARCHAR(50) PRIMARY KEY NOT NULL,
+    value INTEGER NOT NULL
+) WITHOUT ROWID;
+
+CREATE UNIQUE INDEX IF NOT EXISTS uq_players_ff_player_id ON players(ff_player_id);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_games_year_ff_game_id ON games(year, ff_game_id);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_venue_linker_ff_venue_id ON venue_linker(ff_venue_id);
+
+-- then run player_game_stats.py to copy nrl_ps and player_stats into player_game_stats
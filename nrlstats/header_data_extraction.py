@@ -1,7 +1,7 @@
 import json
 import pytz
 from datetime import datetime
-from geopy.distance import geodesic
+from travel_distances import TravelDistances
 import os
 
 class MatchExtraction():
@@ -11,6 +11,7 @@ class MatchExtraction():
         self.get_venue_links()
         self.get_cities()
         self.get_teams()
+        self.distances = TravelDistances(self.wrapper)
         self.data_folder = "/home/paul/Projects/NRLAnalysis/nrlstats/data/Completed"
 
     def get_venue_links(self):
@@ -126,8 +127,7 @@ class MatchExtraction():
         return venueCity
 
     def get_distance(self, team_id, venue_id):
-        home_venue = self.team_venues[team_id]
-        return geodesic(self.coordinates[home_venue], self.coordinates[venue_id]).km
+        return self.distances.get_distance(team_id, venue_id)
 
 
 
@@ -165,10 +165,7 @@ class MatchExtraction():
         nickName = team_data.get('nickName','')
         query = "INSERT INTO teams (ff_team_id, name) VALUES (?, ?);"
         parameters = (ff_team_id, nickName)
-        self.wrapper.execute_query(query, parameters)
-        query = "SELECT id FROM teams WHERE ff_team_id = ?;"
-        parameters = (ff_team_id,)
-        team_id = self.wrapper.fetch(query, parameters)
+        team_id = self.wrapper.insert(query, parameters)
         self.teams[ff_team_id] = team_id
 
     def get_team(self, key, match_data, filename):
@@ -5,14 +5,20 @@ from datetime import datetime
 from geopy.distance import geodesic
 sys.path.append("../")
 from sqlite_wrapper import SQLiteWrapper
+from player_game_stats import PlayerGameStats, NRL_SOURCE
+from ingest_manifest import IngestManifest, LOADED, INVALID
+from archive import JSONArchive, load_record
 from header_data_extraction import MatchExtraction
 
 class Importer():
     def __init__(self):
         self.completed_folder = "/home/paul/Projects/NRLAnalysis/nrlstats/data/Completed"
         self.scheduled_folder = "/home/paul/Projects/NRLAnalysis/nrlstats/data/Scheduled"
-        self.wrapper = SQLiteWrapper(db_name = "/home/paul/Projects/NRLAnalysis/database.db")
+        self.archive = JSONArchive("/home/paul/Projects/NRLAnalysis/nrlstats/data/archive")
+        self.wrapper = SQLiteWrapper(db_name = "/home/paul/Projects/NRLAnalysis/database.db", profile = "bulk-load")
         self.wrapper.connect()
+        self.stats_table = PlayerGameStats(self.wrapper)
+        self.manifest = IngestManifest(self.wrapper, NRL_SOURCE)
         self.get_players()
         self.get_loaded_games()
         self.match_extraction = MatchExtraction(self.wrapper)
@@ -36,8 +42,7 @@ class Importer():
                 header_data['ff_game_id'],
                 header_data['ground_conditions']
                 )
-        self.wrapper.execute_query(query, parameters)
-        database_id = self.wrapper.get_max_index('games')
+        database_id = self.wrapper.insert(query, parameters)
         self.create_game_teams(header_data, database_id)
         return database_id
 
@@ -86,7 +91,7 @@ class Importer():
 
 
     def update_game(self, header_data, game_key):
-        database_id = self.loaded_games[game_key]
+        database_id = self.loaded_games[game_key]['id']
         
         query = "UPDATE games SET weather = ?, ground_conditions = ?, nrl_stats_loaded = 1 WHERE id = ?;"
         parameters = (
@@ -94,15 +99,19 @@ class Importer():
                 header_data['ground_conditions'],
                 database_id
                 )
+        self.wrapper.execute_query(query, parameters)
         return database_id
 
 
 
 
     def get_loaded_games(self):
-        query = "SELECT ff_game_id, year, id, complete FROM games;"
+        query = "SELECT ff_game_id, year, id, complete, nrl_stats_loaded FROM games;"
         loaded_games = self.wrapper.fetch_all(query)
-        self.loaded_games = {f"{x[1]}{x[0]}":{'id':x[2], 'complete':x[3]} for x in loaded_games}
+        self.loaded_games = {self.get_game_key(x[1], x[0]):{'id':x[2], 'complete':x[3], 'nrl_stats_loaded':x[4]} for x in loaded_games}
+
+    def get_game_key(self, year, ff_game_id):
+        return f"{int(year)}_{int(ff_game_id)}"
 
     def load_game(self, filename, game_data):
         # load game data
@@ -114,14 +123,16 @@ class Importer():
         if None in header_data.values():
             print(header_data)
             return
-        game_key = f"{header_data['year']}{header_data['ff_game_id']}"
+        game_key = self.get_game_key(header_data['year'], header_data['ff_game_id'])
         if game_key not in self.loaded_games.keys():
             game_id = self.create_game(header_data)
         else:
             game_id = self.update_game(header_data, game_key)
+            self.clear_player_performances(game_id)
+        self.loaded_games[game_key] = {'id':game_id, 'complete':header_data['complete'], 'nrl_stats_loaded':1}
 
         if not header_data['complete']:
-            return
+            return game_id
     
         self.load_player_performances(game_id, header_data['home_id'], 'homeTeam', match_data)
         self.load_player_performances(game_id, header_data['away_id'], 'awayTeam', match_data)
@@ -134,15 +145,24 @@ class Importer():
                 (ff_player_id, first_name, last_name)
                 VALUES (?, ?, ?);"""
         parameters = (player_data['playerId'], player_data['firstName'], player_data['lastName'])
-        self.wrapper.execute_query(query, parameters)
-        db_id = self.wrapper.get_max_index('players')
+        db_id = self.wrapper.insert(query, parameters)
         self.players_link[player_data['playerId']] = db_id
         return db_id
        
+    def clear_player_performances(self, game_id):
+        """
+        Removes the performances a previous load of this match wrote, so a changed file can be
+        reloaded. The fantasy rows for the game are not touched.
+        """
+        performances = "SELECT id FROM player_performance WHERE game_id = ? AND source = ?"
+        parameters = (game_id, NRL_SOURCE)
+        self.wrapper.execute_query(f"DELETE FROM player_game_stats WHERE player_performance_id IN ({performances});", parameters)
+        self.wrapper.execute_query("DELETE FROM player_performance WHERE game_id = ? AND source = ?;", parameters)
+
     def load_player_performances(self, game_id, team_id, team_key, match_data):
         query = """INSERT INTO player_performance 
-            (game_id, team_id, player_id, position) 
-            VALUES (?, ?, ?, ?);"""
+            (game_id, team_id, player_id, position, source) 
+            VALUES (?, ?, ?, ?, ?);"""
         parameters = []
 
         for player in match_data[team_key]['players']:
@@ -150,7 +170,7 @@ class Importer():
                 player_id = self.create_player(player)
             else:
                 player_id = self.players_link[player['playerId']]
-            parameters.append((game_id, team_id, player_id, player['position']))
+            parameters.append((game_id, team_id, player_id, player['position'], NRL_SOURCE))
 
         self.wrapper.execute_many(query, parameters)
 
@@ -162,44 +182,49 @@ class Importer():
                 JOIN players
                 ON players.id = player_performance.player_id
                 WHERE player_performance.game_id = ?
-                AND player_performance.team_id = ?;"""
-        parameters = (game_id, team_id)
+                AND player_performance.team_id = ?
+                AND player_performance.source = ?;"""
+        parameters = (game_id, team_id, NRL_SOURCE)
         player_p = self.wrapper.fetch_all(query, parameters)
         return {x[1]:x[0] for x in player_p}
 
 
     def load_player_stats(self, match_data, team_id, team_key, game_id, header_data):
-        query = """INSERT INTO nrl_ps
-                (player_performance_id, stat_type, value)
-                VALUES (?, ?, ?);"""
-        ps_parameters = []
+        rows = []
+        is_home = team_key == 'homeTeam'
         performances = self.get_player_performances(game_id, team_id)
         for player in match_data['stats']['players'][team_key]:
             ff_player_id = player['playerId']
             performance_id = performances[ff_player_id]
-            for key, item in player.items():
-                if key in ('playerId', 'penalties'):
-                    continue
-                ps_parameters.append((performance_id, key, item))
-        self.wrapper.execute_many(query, ps_parameters)
-
-
+            stats = {key:item for key, item in player.items() if key not in ('playerId', 'penalties')}
+            rows.append((performance_id, is_home, stats))
+        self.stats_table.write(rows)
 
-    def archive_game(self, filename, folder):
-        file_path = os.path.join(folder, filename)
-        
 
 
     def import_game(self, folder, filename):
         file_path = os.path.join(folder, filename)
+        record = lambda status: self.manifest.record(file_path, status)
 
         try:
             with open(file_path, "r") as f:
                 game_data = json.load(f)
-        except:
-            print(f"error opening or importing {file_path}")
-            exit()
+        except (OSError, ValueError) as e:
+            print(f"error opening or importing {file_path}: {e}")
+            record(INVALID)
+            return
+
+        self.import_game_data(filename, game_data, file_path, record)
+
+    def import_archived_game(self, archive_path, name, raw_data, record_hash):
+        key = f"{archive_path}:{name}"
+        record = lambda status: self.manifest.record_archived(key, len(raw_data), record_hash, status)
+        self.import_game_data(name, load_record(raw_data), key, record)
 
+    def import_game_data(self, filename, game_data, key, record):
+        """
+        key is the manifest key of the source and record(status) writes its manifest entry.
+        """
         header_data = game_data.get('match','')
         if header_data == '':
             print(f"{filename} does not contain header data")
@@ -211,17 +236,72 @@ class Importer():
             print(f"{filename} does not contain header data")
             return
 
-        if match_id in self.loaded_games.keys() and self.loaded_games[match_id]['complete']:
-            self.archive_game(filename, folder)
+        try:
+            game_key = self.get_game_key(str(match_id)[:4], str(match_id)[4:])
+        except ValueError:
+            print(f"{filename} has a malformed matchId")
+            return
+        loaded_game = self.loaded_games.get(game_key)
+        if loaded_game and loaded_game['complete'] and loaded_game['nrl_stats_loaded'] and not self.manifest.is_known(key):
+            # loaded before the manifest existed or before the file was packed. Game rows the
+            # fantasy importer created have nrl_stats_loaded = 0 and are loaded here
+            record(LOADED)
             return
 
-        self.load_game(filename, game_data)
-
-    def load_games(self, folder):
+        if self.load_game(filename, game_data) is None:
+            record(INVALID)
+            return
+        record(LOADED)
+
+    def get_changed_records(self, archive):
+        records = {}
+        for season in archive.get_seasons():
+            archive_path, _ = archive.get_paths(season)
+            for name, (offset, length, record_hash) in archive.get_index(season).items():
+                if not self.manifest.is_current_record(f"{archive_path}:{name}", record_hash):
+                    records.setdefault(season, set()).add(name)
+        return records
+
+    def load_games(self, folder, archive=None):
         filelist = sorted([x for x in os.listdir(folder) if x.endswith('.json')])
-        for filename in filelist[:]:
-            print(filename)
-            self.import_game(folder, filename)
+        # a match that is also in the archive is loaded from the archive copy
+        archived_names = archive.get_names() if archive is not None else set()
+        filelist = [x for x in filelist if x not in archived_names and not self.manifest.is_current(os.path.join(folder, x))]
+        records = self.get_changed_records(archive) if archive is not None else {}
+        record_count = sum([len(x) for x in records.values()])
+        print("INFO", f"{len(filelist)} new or changed files, {record_count} new or changed archived matches")
+        if not filelist and not records:
+            # rebuilds indexes left dropped by a full reload that did not finish
+            self.wrapper.create_indexes()
+            return
+        # on a full reload build the indexes once at the end
+        if not self.loaded_games:
+            self.wrapper.drop_indexes()
+        try:
+            with self.wrapper.transaction():
+                # a game that fails is rolled back and logged, the others are still committed
+                for filename in filelist[:]:
+                    print(filename)
+                    with self.wrapper.savepoint("game", on_error=self.reload_ids):
+                        self.import_game(folder, filename)
+                # each season is read with one pass over its archive file
+                for season, names in records.items():
+                    archive_path, _ = archive.get_paths(season)
+                    for name, raw_data, record_hash in archive.iter_raw(season):
+                        if name not in names:
+                            continue
+                        print(name)
+                        with self.wrapper.savepoint("game", on_error=self.reload_ids):
+                            self.import_archived_game(archive_path, name, raw_data, record_hash)
+        finally:
+            self.wrapper.create_indexes()
+        self.wrapper.print_statement_stats()
+
+    def reload_ids(self, error=None):
+        # players, games and stat columns created in a rolled back savepoint no longer exist
+        self.get_players()
+        self.get_loaded_games()
+        self.stats_table.get_columns()
 i = Importer()
-i.load_games(i.completed_folder)
+i.load_games(i.completed_folder, i.archive)
 #i.load_games(i.scheduled_folder)
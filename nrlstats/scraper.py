@@ -2,85 +2,162 @@ import requests
 import time
 import json
 import os
+import re
+import sys
+from html.parser import HTMLParser
 from bs4 import BeautifulSoup
+sys.path.append("../")
+from fetch_scheduler import FetchScheduler
+from http_client import HTTPClient, ResponseCache
+from archive import JSONArchive
+from checkpoint import CheckpointStore
+
+class QDataFound(Exception):
+    pass
+
+class QDataParser(HTMLParser):
+    """
+    Reads the q-data attribute of the first tag it is fed, then stops. Attribute values are
+    unescaped by HTMLParser, no DOM is built.
+    """
+    def __init__(self, div_id):
+        super().__init__(convert_charrefs=True)
+        self.div_id = div_id
+        self.q_data = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'div' and attrs.get('id') == self.div_id:
+            self.q_data = attrs.get('q-data')
+        raise QDataFound()
+
+def find_qdata(html, div_id):
+    """
+    Finds the div by its id with a string search and parses only that start tag.
+    Returns None when the fast path cannot find the attribute.
+    """
+    match = re.search(r'(?<![\w-])id\s*=\s*["\']' + re.escape(div_id) + r'["\']', html)
+    if match is None:
+        return None
+    start = html.rfind('<div', 0, match.start())
+    if start == -1:
+        return None
+    parser = QDataParser(div_id)
+    try:
+        parser.feed(html[start:])
+    except QDataFound:
+        pass
+    return parser.q_data
 
 class NRLStatsScraper:
-    def __init__(self, crawl_delay=5, retries=3, base_folder="/home/paul/Projects/NRLAnalysis/nrlstats", load_scheduled=False):
+    def __init__(self, crawl_delay=5, retries=3, base_folder="/home/paul/Projects/NRLAnalysis/nrlstats", load_scheduled=False, max_in_flight=4, burst=1, offline=False):
         self.load_scheduled = load_scheduled
         self.crawl_delay = crawl_delay
         self.retries = retries
-        self.last_request = time.time() - crawl_delay
+        # draw pages and unfinished matches are revalidated after an hour,
+        # finished matches and fully played draws are pinned and never refetched, a draw that is
+        # still being played changes with every result so it expires after 10 minutes
+        cache = ResponseCache(
+                os.path.join(base_folder, "cache"),
+                ttl_rules=[(r"/draw/\?", 600)],
+                default_ttl=3600,
+                offline=offline)
+        self.scheduler = FetchScheduler(
+                self.fetch_page,
+                requests_per_second=1 / crawl_delay,
+                burst=burst,
+                max_in_flight=max_in_flight,
+                retries=retries,
+                backoff=crawl_delay,
+                is_cached=self.is_cached)
+        self.headers = {
+            "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:135.0) Gecko/20100101 Firefox/135.0",
+            "Accept": "*/*",
+            "Accept-Language": "en-US,en;q=0.5",
+            "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
+            "X-Requested-With": "XMLHttpRequest",
+        }
+        # retries=0 as the scheduler retries inside the rate limit
+        self.client = HTTPClient(headers=self.headers, retries=0, pool_size=max_in_flight, cache=cache)
         self.base_api_url = "https://www.nrl.com"
         self.base_folder = base_folder
         self.completed_folder = os.path.join(base_folder, "data/Completed")
         self.scheduled_folder = os.path.join(base_folder, "data/Scheduled")
+        # finished matches are appended to a per season archive instead of a file each
+        self.archive = JSONArchive(os.path.join(base_folder, "data/archive"))
         self.status_filepath = os.path.join(self.base_folder, "status.json")
         os.makedirs(self.completed_folder, exist_ok=True)
         self.import_status()
 
     def import_status(self):
         try:
-            with open(self.status_filepath, "r") as f:
-                self.status = json.load(f)
+            # progress is appended to status.json.log and compacted into status.json
+            self.checkpoint = CheckpointStore(self.status_filepath, compact_every=50)
+            self.status = self.checkpoint.state
             if not isinstance(self.status, dict):
                 raise ValueError(f"status.json at {self.status_filepath} is malformed: Expected a dictionary")
         except FileNotFoundError:
             raise FileNotFoundError(f"status.json not found at {self.status_filepath}. Create a valid status.json to proceed.")
         except json.JSONDecodeError:
             raise ValueError(f"status.json at {self.status_filepath} is corrupted. Provide a valid JSON file.")
-        self.existing_filelist = set(os.listdir(self.completed_folder))
+        self.existing_filelist = set(os.listdir(self.completed_folder)) | self.archive.get_names()
 
     def save_json(self, data, filename, matchState):
         if matchState == "FullTime":
-            filepath = os.path.join(self.completed_folder, filename)
-        else:
-            filepath = os.path.join(self.scheduled_folder, filename)
-            if not self.load_scheduled:
-                print("Completed games scraped")
-                exit()
+            # filenames start with the season, e.g. 2025_round-1_...
+            self.archive.append(filename[:4], filename, data)
+            self.existing_filelist.add(filename)
+            print(f"Archived {filename}")
+            return
 
+        if not self.load_scheduled:
+            print("Completed games scraped")
+            exit()
+        filepath = os.path.join(self.scheduled_folder, filename)
         with open(filepath, 'w', encoding='utf-8') as f:
             json.dump(data, f, indent=2)
-        self.existing_filelist.add(filename)
         print(f"Saved data to {filepath}")
 
-    def get_data(self, extension):
+    def fetch_page(self, url):
         """
-        Fetches HTML from a given URL extension and returns BeautifulSoup object.
-        Retries up to self.retries times with delays.
+        Fetches a single URL and returns the page HTML. Called from the scheduler's
+        worker threads, raises on any failure so the scheduler can retry.
         """
-        url = self.base_api_url + extension
         print(url)
-        headers = {
-            "User-Agent": "Mozilla/5.0 (X11; Linux x86_64; rv:135.0) Gecko/20100101 Firefox/135.0",
-            "Accept": "*/*",
-            "Accept-Language": "en-US,en;q=0.5",
-            "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
-            "X-Requested-With": "XMLHttpRequest",
-        }
-
-        for attempt in range(1, self.retries + 1):
-            delay = max(self.crawl_delay - (time.time() - self.last_request), 0)
-            time.sleep(delay)
-            self.last_request = time.time()
+        response = self.client.get(url)
+        if response.status_code != 200:
+            raise requests.RequestException(f"Received status code {response.status_code}")
+        return response.text
 
-            try:
-                response = requests.get(url, headers=headers)
-                if response.status_code == 200:
-                    return BeautifulSoup(response.text, "html.parser")
-                else:
-                    print(f"Attempt {attempt}: Received status code {response.status_code}")
-            except requests.RequestException as e:
-                print(f"Attempt {attempt}: Request failed: {e}")
+    def is_cached(self, url):
+        return self.client.is_cached(url)
 
-            time.sleep(self.crawl_delay)
+    def get_data(self, extension):
+        """
+        Fetches HTML from a given URL extension and returns it as text.
+        Retries up to self.retries times with backoff.
+        """
+        return self.scheduler.fetch_with_retries(self.base_api_url + extension)
 
-        raise Exception(f"Failed to fetch data from {url} after {self.retries} retries")
+    def get_all_data(self, extensions):
+        """
+        Fetches every extension concurrently within the crawl rate limit and yields the
+        page HTML in the same order.
+        """
+        return self.scheduler.map([self.base_api_url + x for x in extensions])
 
-    def extract_qdata(self, soup, div_id):
+    def extract_qdata(self, html, div_id):
         """
         Extracts and parses JSON from the 'q-data' attribute of a specified div.
+        Only falls back to a full BeautifulSoup parse when the fast path fails.
         """
+        q_data_str = find_qdata(html, div_id)
+        if q_data_str is not None:
+            try:
+                return json.loads(q_data_str)
+            except json.JSONDecodeError:
+                pass
+        soup = BeautifulSoup(html, "html.parser")
         div = soup.find('div', id=div_id)
         if div and div.has_attr('q-data'):
             q_data_str = div['q-data']
@@ -89,38 +166,65 @@ class NRLStatsScraper:
             raise ValueError(f"No div with id='{div_id}' and 'q-data' attribute found.")
 
 
-    def scrape_match_data(self, extension, matchState):
-        """
-        Fetches match data from a matchCentreUrl and saves it as a JSON file.
-        """
-        if matchState != "FullTime" and not self.load_scheduled:
-            return False
+    def get_match_filename(self, extension):
         filename = extension.replace("/", "_")
         filename = filename.replace("_draw_nrl-premiership_", "")
-        filename = (filename + ".json").replace("_.json", ".json")
-        if filename in self.existing_filelist:
-            return True
-        soup = self.get_data(extension)
-        data = self.extract_qdata(soup, 'vue-match-centre')
-        self.save_json(data, filename, matchState)
-        return True
+        return (filename + ".json").replace("_.json", ".json")
+
+    def scrape_matches(self, fixtures):
+        """
+        Fetches the match centre pages of a list of (matchCentreUrl, matchState) fixtures
+        concurrently and saves each one as it arrives.
+        """
+        pending = []
+        for extension, matchState in fixtures:
+            if matchState != "FullTime" and not self.load_scheduled:
+                continue
+            if self.get_match_filename(extension) in self.existing_filelist:
+                continue
+            pending.append((extension, matchState))
+
+        pages = self.get_all_data([x[0] for x in pending])
+        for (extension, matchState), html in zip(pending, pages):
+            data = self.extract_qdata(html, 'vue-match-centre')
+            if matchState == "FullTime":
+                self.client.pin(self.base_api_url + extension)
+            self.save_json(data, self.get_match_filename(extension), matchState)
+
+    def pin_completed_draw(self, extension, fixtures, is_stopped):
+        if not is_stopped and fixtures and all(x[1] == "FullTime" for x in fixtures):
+            self.client.pin(self.base_api_url + extension)
+
+    def get_round_fixtures(self, data, year, round_number):
+        """
+        Returns the (matchCentreUrl, matchState) pairs of a draw and whether the draw stopped
+        at a match that is not finished.
+        """
+        fixtures = []
+        for fixture in data.get('fixtures', []):
+            match_extension = fixture.get('matchCentreUrl')
+            matchState = fixture.get('matchState')
+            if matchState not in ("Fulltime", "FullTime") and not self.load_scheduled:
+                print(matchState, year, round_number, match_extension)
+                print("Completed matches loaded")
+                print("Scheduled matches not required")
+                return fixtures, True
+
+            if match_extension:
+                fixtures.append((match_extension, matchState))
+        return fixtures, False
 
     def update_status_round(self, year, round_number, matchState):
-        yearstring = str(year)
         if matchState == "FullTime":
-            self.status[yearstring]["rounds"].append(round_number)
+            self.checkpoint.add([year, "rounds"], round_number)
         else:
-            self.status[yearstring]["scheduled_rounds"].append(round_number)
-        self.save_status()
+            self.checkpoint.add([year, "scheduled_rounds"], round_number)
 
     def update_status_year(self, year):
-        yearstring = str(year)
-        self.status[yearstring]["complete"] = True
-        self.save_status()
+        self.checkpoint.set([year, "complete"], True)
 
     def save_status(self):
-        with open(self.status_filepath, "w") as f:
-            json.dump(self.status, f)
+        self.checkpoint.compact()
 
     def get_no_rounds(self, year):
         """
@@ -136,11 +240,11 @@ class NRLStatsScraper:
             ValueError: If the draw page cannot be fetched or rounds cannot be parsed.
         """
         extension = f"/draw/?competition=111&round=1&season={year}"
-        soup = self.get_data(extension)
-        if not soup:
+        html = self.get_data(extension)
+        if not html:
             raise ValueError(f"Failed to fetch draw page for year {year}")
         try:
-            data = self.extract_qdata(soup, 'vue-draw')
+            data = self.extract_qdata(html, 'vue-draw')
             rounds = [x['value'] for x in data.get('filterRounds', []) if 'Round' in x.get('name', '')]
             if not rounds:
                 raise ValueError(f"No regular-season rounds found in draw data for year {year}")
@@ -152,42 +256,56 @@ class NRLStatsScraper:
         """
         Scrapes match data for a specific round in a given year.
         """
-        is_round_complete = False
         if round_number in self.status[str(year)]["rounds"]:
             print(f"Year {year} Round {round_number} already completed")
             return
         extension = f"/draw/?competition=111&round={round_number}&season={year}"
-        soup = self.get_data(extension)
-        data = self.extract_qdata(soup, 'vue-draw')
-
-        for fixture in data.get('fixtures', []):
-            match_extension = fixture.get('matchCentreUrl')
-            matchState = fixture.get('matchState')
-            if matchState not in ("Fulltime", "FullTime") and not self.load_scheduled:
-                print(matchState, year, round_number, match_extension)
-                print("Completed matches loaded")
-                print("Scheduled matches not required")
-                exit()
-
-            if match_extension:
-                self.scrape_match_data(match_extension, matchState)
-        self.update_status_round(year, round_number, matchState)
+        html = self.get_data(extension)
+        data = self.extract_qdata(html, 'vue-draw')
+        fixtures, is_stopped = self.get_round_fixtures(data, year, round_number)
+        self.pin_completed_draw(extension, fixtures, is_stopped)
+        self.scrape_matches(fixtures)
+        if is_stopped:
+            exit()
+        if fixtures:
+            self.update_status_round(year, round_number, fixtures[-1][1])
             
     def scrape_year(self, year):
         """
-        Scrapes all rounds for a given year.
+        Scrapes all rounds for a given year. The draw pages of every outstanding round are
+        fetched together, then all of their match centre pages are queued at once.
         """
         yearstring = str(year)
         if yearstring not in self.status:
-            self.status[yearstring] = {"complete":False, "rounds":[]}
+            self.checkpoint.set([yearstring], {"complete":False, "rounds":[]})
         #if self.status[yearstring]["complete"]:
         #    print(f"{year} already completed")
         #    return
         total_rounds = self.get_no_rounds(year)
         print(f"Starting scrape for {year} ({total_rounds} rounds)")
-        for rnd in range(1, total_rounds + 1):
-            print(f"Scraping Round {rnd}")
-            self.scrape_round(year, rnd)
+        rounds = [x for x in range(1, total_rounds + 1) if x not in self.status[yearstring]["rounds"]]
+        extensions = [f"/draw/?competition=111&round={x}&season={year}" for x in rounds]
+
+        season_fixtures = []
+        round_states = []
+        is_stopped = False
+        for rnd, extension, html in zip(rounds, extensions, self.get_all_data(extensions)):
+            data = self.extract_qdata(html, 'vue-draw')
+            fixtures, is_stopped = self.get_round_fixtures(data, year, rnd)
+            self.pin_completed_draw(extension, fixtures, is_stopped)
+            season_fixtures += fixtures
+            if is_stopped:
+                break
+            if fixtures:
+                round_states.append((rnd, fixtures[-1][1]))
+
+        print(f"Scraping {len(season_fixtures)} matches from {len(round_states)} rounds")
+        self.scrape_matches(season_fixtures)
+        for rnd, matchState in round_states:
+            self.update_status_round(year, rnd, matchState)
+        self.save_status()
+        if is_stopped:
+            exit()
         #self.update_status_year(year)
 
 if __name__ == "__main__":
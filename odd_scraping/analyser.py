@@ -3,30 +3,77 @@ import json
 import time
 import datetime
 import re
-from bs4 import BeautifulSoup
+from html.parser import HTMLParser
+from multiprocessing import Pool
 
 
-
-
-
-
-class Scraper():
+class EventRowParser(HTMLParser):
+    """
+    Collects the text of every div with the eventRow class as the html is fed, the same text
+    BeautifulSoup's row.text gives, without building a tree.
+    """
     def __init__(self):
-        self.base_folder = "/home/paul/Projects/NRLAnalysis/odd_scraping/"
-        self.html_folder = "raw_html_oddsportal/"
-        self.get_name_conversion_dict()
-        self.games = []
-        self.scrape_all()
-        self.save_data()
-        print(len(self.games))
-
-    def save_data(self):
-        with open(self.base_folder+"odds_data.json", "w") as f:
-            json.dump(self.games, f, indent=4)
-
-    def get_name_conversion_dict(self):
-        with open(self.base_folder+"name_conversion.json", "r") as f:
-            self.name_conversion = json.load(f)
+        super().__init__(convert_charrefs=True)
+        self.rows = []
+        self.text = []
+        # div depth inside the current row, 0 outside of a row
+        self.depth = 0
+        self.skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self.skip += 1
+        if tag != "div":
+            return
+        if self.depth:
+            self.depth += 1
+        elif "eventRow" in (dict(attrs).get("class") or "").split():
+            self.depth = 1
+            self.text = []
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style") and self.skip:
+            self.skip -= 1
+        if tag != "div" or not self.depth:
+            return
+        self.depth -= 1
+        if not self.depth:
+            self.rows.append("".join(self.text))
+
+    def handle_data(self, data):
+        if self.depth and not self.skip:
+            self.text.append(data)
+
+
+def get_rows(filename, chunk_size=65536):
+    parser = EventRowParser()
+    with open(filename, "r") as f:
+        for chunk in iter(lambda: f.read(chunk_size), ""):
+            parser.feed(chunk)
+            yield from parser.rows
+            parser.rows = []
+    parser.close()
+    yield from parser.rows
+
+
+def scrape_file(source):
+    """
+    Extracts the games of one saved page. Runs in a worker process.
+    """
+    filename, name_conversion = source
+    row_parser = RowParser(name_conversion)
+    games = []
+    date_string = None
+    for text in get_rows(filename):
+        date_string, details = row_parser.analyse_row(text, date_string)
+        if details is not None:
+            games.append(details)
+    return filename, games
+
+
+class RowParser():
+    def __init__(self, name_conversion):
+        self.name_conversion = name_conversion
 
     def get_teams(self, match_string):
         teams = match_string.split("–")
@@ -76,12 +123,13 @@ class Scraper():
         return details
 
 
-    def analyse_row(self, row, date_string):
-        text = str(row.text)
-        print(text)
+    def analyse_row(self, text, date_string):
+        """
+        Returns the date carried to the next row and the game of this row, or None.
+        """
         if "canc." in text or "Pre-season" in text or "Indigenous" in text or "Maori" in text:
             print(text)
-            return
+            return None, None
         
         text = text.replace(" OT","")
         text = text.replace("Add to my coupon","")
@@ -91,40 +139,50 @@ class Scraper():
 
         game_match = re.search(r"\d\d:\d\d.+$", text)
         if game_match is None:
-            return date_string
+            return date_string, None
         if date_string== None:
-            return
+            return None, None
         match_string = game_match.group(0)
         time_string = match_string[:5]
         match_string = match_string[5:]
         details = self.get_details(match_string)
         details["date"] = date_string
         details["time"] = time_string
-        self.games.append(details)
-        #print(details)
-
-
-        return date_string
-        
-
-    def scrape_file(self, filename):
-        with open(filename, "r") as f:
-            plaintext = f.read()
-        soup = BeautifulSoup(plaintext, features="html.parser")
-        #print(soup)
-        rows = soup.find_all('div', class_="eventRow")
-        date_string = None
-        for row in rows[:]:
-            date_string = self.analyse_row(row, date_string)
+        return date_string, details
 
 
+class Scraper():
+    def __init__(self, workers=None):
+        self.base_folder = "/home/paul/Projects/NRLAnalysis/odd_scraping/"
+        self.html_folder = "raw_html_oddsportal/"
+        self.workers = workers
+        self.get_name_conversion_dict()
+        self.no_games = self.scrape_all()
+        print(self.no_games)
 
+    def get_name_conversion_dict(self):
+        with open(self.base_folder+"name_conversion.json", "r") as f:
+            self.name_conversion = json.load(f)
 
     def scrape_all(self):
+        """
+        Parses the saved pages on a process pool and appends each page's games to odds_data.jsonl
+        as soon as it is parsed, one json object per line.
+        """
         folder = self.base_folder+self.html_folder
-        file_list = sorted(os.listdir(folder))
-        for file in file_list[:]:
-            self.scrape_file(folder + file)
-
-
-s = Scraper()
+        sources = [(folder + x, self.name_conversion) for x in sorted(os.listdir(folder))]
+        output_path = self.base_folder + "odds_data.jsonl"
+        temp_path = f"{output_path}.{os.getpid()}.tmp"
+        no_games = 0
+        with Pool(processes=self.workers) as pool, open(temp_path, "w") as f:
+            for filename, games in pool.imap(scrape_file, sources):
+                print(filename, len(games))
+                for details in games:
+                    f.write(json.dumps(details) + "\n")
+                no_games += len(games)
+        os.replace(temp_path, output_path)
+        return no_games
+
+
+if __name__ == "__main__":
+    s = Scraper()
@@ -1,9 +1,9 @@
-cat odds_data.json |grep "2018"|wc
-cat odds_data.json |grep "2019"|wc
-cat odds_data.json |grep "2020"|wc
-cat odds_data.json |grep "2021"|wc
-cat odds_data.json |grep "2022"|wc
-cat odds_data.json |grep "2023"|wc
-cat odds_data.json |grep "2024"|wc
-cat odds_data.json |grep "2025"|wc
+cat odds_data.jsonl |grep "2018"|wc
+cat odds_data.jsonl |grep "2019"|wc
+cat odds_data.jsonl |grep "2020"|wc
+cat odds_data.jsonl |grep "2021"|wc
+cat odds_data.jsonl |grep "2022"|wc
+cat odds_data.jsonl |grep "2023"|wc
+cat odds_data.jsonl |grep "2024"|wc
+cat odds_data.jsonl |grep "2025"|wc
 
@@ -1,8 +1,52 @@
 from sqlite_wrapper import SQLiteWrapper
 from datetime import datetime
+from bisect import bisect_left, bisect_right
 import json
 import os
 
+class MatchResolver():
+    """
+    Finds the game of an odds record from its team pair and date. Games are indexed by (home, away)
+    with their dates sorted, and the game closest in date within window days matches, as oddsportal
+    times can put a game on the day before or after its local date.
+    """
+    def __init__(self, games, window=1):
+        self.window = window
+        self.index = {}
+        for game_id, home_team_id, home_team, away_team_id, away_team, date_string in games:
+            if date_string is None:
+                continue
+            ordinal = datetime.strptime(date_string, "%Y-%m-%d").toordinal()
+            self.index.setdefault((home_team, away_team), []).append((ordinal, game_id, home_team_id, away_team_id))
+        for entries in self.index.values():
+            entries.sort()
+
+    def is_known_pair(self, home_team, away_team):
+        return (home_team, away_team) in self.index
+
+    def get_closest(self, home_team, away_team, date_string):
+        """
+        Returns the (game_id, home_team_id, away_team_id) of the games within the window that are
+        closest in date, more than one when games either side of the date are equally close.
+        """
+        entries = self.index.get((home_team, away_team))
+        if not entries:
+            return []
+        ordinal = datetime.strptime(date_string, "%Y-%m-%d").toordinal()
+        start = bisect_left(entries, (ordinal - self.window,))
+        end = bisect_right(entries, (ordinal + self.window, float("inf")))
+        if start == end:
+            return []
+        distance = min([abs(x[0] - ordinal) for x in entries[start:end]])
+        return [x[1:] for x in entries[start:end] if abs(x[0] - ordinal) == distance]
+
+    def resolve(self, home_team, away_team, date_string):
+        """
+        Returns (game_id, home_team_id, away_team_id), or None when there is no game or a tie.
+        """
+        closest = self.get_closest(home_team, away_team, date_string)
+        return closest[0] if len(closest) == 1 else None
+
 class OddsImporter():
     def __init__(self):
         self.base_folder = "/home/paul/Projects/NRLAnalysis/"
@@ -13,16 +57,20 @@ class OddsImporter():
         self.load_odds()
     
     def get_odds(self):
-        filename = self.base_folder + "odd_scraping/odds_data.json"
+        # odds_data.jsonl is written by odd_scraping/analyser.py, odds_data.json by older runs
+        filename = self.base_folder + "odd_scraping/odds_data.jsonl"
+        if not os.path.exists(filename):
+            with open(self.base_folder + "odd_scraping/odds_data.json", "r") as f:
+                self.odds_data = json.load(f)
+            return
         with open(filename, "r") as f:
-            self.odds_data = json.load(f)
+            self.odds_data = [json.loads(x) for x in f if x.strip()]
 
     def convert_date(self, date_string):
         date_obj = datetime.strptime(date_string, "%d %b %Y")
         return date_obj.strftime("%Y-%m-%d")
 
     def get_games(self):
-        self.games = {}
         query = "SELECT games.id, home_team.id, home_team.name, away_team.id, away_team.name,\
                 games.date \
                 FROM games \
@@ -31,31 +79,48 @@ class OddsImporter():
                 JOIN teams home_team ON home.team_id = home_team.id\
                 JOIN teams away_team ON away.team_id = away_team.id;"
         data = self.wrapper.fetch_all(query)
-        for game in data:
-            key_string = f"{game[5]}_{game[2]}_{game[4]}"
-            self.games[key_string] = (game[0], game[1], game[3])
-            print(key_string)
+        self.resolver = MatchResolver(data)
 
 
     def write_to_db(self, parameters):
-        query = "UPDATE game_teams SET win_odds = ? WHERE game_id = ? AND team_id = ?;"
-        self.wrapper.execute_many(query, parameters)
+        rows = [(game_id, team_id, odds) for odds, game_id, team_id in parameters]
+        count = self.wrapper.bulk_upsert("game_teams", ["game_id", "team_id"], ["win_odds"], rows)
+        print("INFO", f"{count} odds changed")
+
+    def save_unmatched(self, unmatched):
+        filename = self.base_folder + "odd_scraping/unmatched_odds.jsonl"
+        with open(filename, "w") as f:
+            for reason, item in unmatched:
+                f.write(json.dumps({"reason": reason, "odds": item}) + "\n")
+        print("INFO", f"{len(unmatched)} odds records not matched to a game, see {filename}")
 
     def load_odds(self):
         parameters = []
+        unmatched = []
+        matched_games = set()
         for item in self.odds_data[:]:
             date_string = self.convert_date(item["date"])
-            key = f"{date_string}_{item['home_team']}_{item['away_team']}"
+            closest = self.resolver.get_closest(item['home_team'], item['away_team'], date_string)
+            if not closest:
+                if self.resolver.is_known_pair(item['home_team'], item['away_team']):
+                    unmatched.append(("no game within a day", item))
+                else:
+                    unmatched.append(("no game for this home and away team", item))
+                continue
+            if len(closest) > 1:
+                unmatched.append((f"games {', '.join([str(x[0]) for x in closest])} are equally close", item))
+                continue
+            game_id, home_team_id, away_team_id = closest[0]
+            if game_id in matched_games:
+                unmatched.append((f"game {game_id} already matched", item))
+                continue
+            matched_games.add(game_id)
             home_odds = item['home_odds']
             away_odds = item['away_odds']
-            game_data = self.games.get(key)
-            if game_data is None:
-                continue
-            game_id = game_data[0]
-            home_team_id = game_data[1]
-            away_team_id = game_data[2]
             parameters.append((home_odds, game_id, home_team_id))
             parameters.append((away_odds, game_id, away_team_id))
+        print("INFO", f"{len(matched_games)} of {len(self.odds_data)} odds records matched")
+        self.save_unmatched(unmatched)
         self.write_to_db(parameters)
 
 
@@ -1,4 +1,5 @@
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
 class Optimizer:
     """
@@ -11,18 +12,26 @@ class Optimizer:
             The tolerance for slope approximation to consider when convergence is reached.
         max_iter: int
             The maximum number of iterations for the refinement search.
+        vectorized: bool
+            Whether the objective accepts a numpy array of alphas and returns an array of values.
+        batch_points: int
+            The number of interior points checked per refinement step when vectorized.
     """
     
-    def __init__(self, tolerance=0.001, max_iter=100):
+    def __init__(self, tolerance=0.001, max_iter=100, vectorized=False, batch_points=8):
         """
         Initializes the Optimizer with a tolerance and max iterations.
         
         Args:
             tolerance (float): The tolerance for the slope to stop the search (default is 0.001).
             max_iter (int): The maximum number of iterations for the search (default is 100).
+            vectorized (bool): Evaluate the objective over arrays of alphas in one call (default is False).
+            batch_points (int): Interior points per refinement step when vectorized (default is 8).
         """
         self.tolerance = tolerance
         self.max_iter = max_iter
+        self.vectorized = vectorized
+        self.batch_points = batch_points
 
     def calculate_metric(self, f, alpha, *params):
         """
@@ -37,6 +46,39 @@ class Optimizer:
             float: The value of the objective function at alpha.
         """
         return f(alpha, *params)
+
+    def calculate_metrics(self, f, alphas, *params):
+        """
+        Calculates the value of the objective function at every point of alphas, in a single call
+        when the objective is vectorized.
+
+        Args:
+            f (callable): The function to be optimized.
+            alphas (np.ndarray): The inputs to the objective function.
+            params (tuple): Additional parameters to pass to the function.
+
+        Returns:
+            np.ndarray: The value of the objective function at each alpha.
+        """
+        if self.vectorized:
+            return np.asarray(f(alphas, *params), dtype=float)
+        return np.array([self.calculate_metric(f, alpha, *params) for alpha in alphas], dtype=float)
+
+    def calculate_slopes(self, f, xs, dx, *params):
+        """
+        Calculates the central difference slope at every point of xs with one batch of evaluations.
+
+        Args:
+            f (callable): The function to be optimized.
+            xs (np.ndarray): The points at which to calculate the slopes.
+            dx (float): The small change in x used for the central difference calculation.
+            params (tuple): Additional parameters to pass to the function.
+
+        Returns:
+            np.ndarray: The approximated slopes of the function at xs.
+        """
+        values = self.calculate_metrics(f, np.concatenate([xs + dx, xs - dx]), *params)
+        return (values[:len(xs)] - values[len(xs):]) / (2 * dx)
     
     def calculate_slope(self, f, x, dx=1e-6, *params):
         """
@@ -69,15 +111,9 @@ class Optimizer:
         Returns:
             tuple: The left and right bounds of the interval for refinement.
         """
-        best_alpha = None
-        best_metric = -float('inf')
-        
-        # Iterate over the range with the given step size
-        for alpha in np.arange(param_range[0], param_range[1], step):
-            metric_value = self.calculate_metric(f, alpha, *params)
-            if metric_value > best_metric:
-                best_metric = metric_value
-                best_alpha = alpha
+        # Evaluate the whole grid in one batch and keep the first best point
+        alphas = np.arange(param_range[0], param_range[1], step)
+        best_alpha = alphas[np.argmax(self.calculate_metrics(f, alphas, *params))]
         
         # Find the interval around the best alpha for refinement
         left_bound = best_alpha - step
@@ -129,6 +165,38 @@ class Optimizer:
         print("Max iterations reached.")
         return (alpha_a + alpha_b) / 2  # Return midpoint as the approximate max value
 
+    def refine_search_batch(self, f, alpha_a, alpha_b, *params):
+        """
+        Refines the search like refine_search, but checks the slopes at both bounds and at
+        batch_points interior points in one batch of evaluations, so each step shrinks the
+        interval by a factor of batch_points + 1 instead of 2.
+
+        Args:
+            f (callable): The function to be optimized.
+            alpha_a (float): The left bound of the search range.
+            alpha_b (float): The right bound of the search range.
+            params (tuple): Additional parameters to pass to the function.
+
+        Returns:
+            float: The estimated maximum value of alpha within the range.
+        """
+        for iteration in range(self.max_iter):
+            dx = (alpha_b - alpha_a) / 100
+            alphas = np.linspace(alpha_a, alpha_b, self.batch_points + 2)
+            slopes = self.calculate_slopes(f, alphas, dx, *params)
+
+            if abs(slopes[0]) < self.tolerance and abs(slopes[-1]) < self.tolerance:
+                print(f"Maxima found between {alpha_a} and {alpha_b}")
+                return (alpha_a + alpha_b) / 2
+
+            # The maxima is left of the first interior point with a negative slope
+            negatives = np.nonzero(slopes[1:-1] < 0)[0]
+            index = negatives[0] + 1 if len(negatives) else len(alphas) - 1
+            alpha_a, alpha_b = alphas[index - 1], alphas[index]
+
+        print("Max iterations reached.")
+        return (alpha_a + alpha_b) / 2
+
     def general_search(self, f, param_range=(0, 1), step=0.05, *params):
         """
         Perform a full search for the optimal point using a coarse search followed by refinement.
@@ -146,8 +214,31 @@ class Optimizer:
         alpha_a, alpha_b = self.coarse_search(f, param_range, step, *params)
         
         # Refine the search within the bounds found by the coarse search
+        if self.vectorized:
+            return self.refine_search_batch(f, alpha_a, alpha_b, *params)
         return self.refine_search(f, alpha_a, alpha_b, *params)
 
+    def multi_search(self, f, params_list, param_range=(0, 1), step=0.05, workers=None):
+        """
+        Runs an independent general search for every set of parameters, e.g. one per team, on a
+        process pool. f must be picklable (defined at module level) when workers is not 1.
+
+        Args:
+            f (callable): The function to be optimized.
+            params_list (list): One tuple of additional parameters per search.
+            param_range (tuple): The range of alpha values to search over (default is (0, 1)).
+            step (float): The step size for the coarse search (default is 0.05).
+            workers (int): The number of processes, None uses every cpu and 1 runs in this process.
+
+        Returns:
+            list: The optimal value of alpha for each set of parameters, in order.
+        """
+        if workers == 1:
+            return [self.general_search(f, param_range, step, *params) for params in params_list]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(self.general_search, f, param_range, step, *params) for params in params_list]
+            return [future.result() for future in futures]
+
 
 # Example Function (f(x) that you want to optimize)
 def example_function(x):
@@ -157,12 +248,18 @@ def example_function(x):
     return -(x - 0.5)**2 + 1
 
 # Example Usage:
+if __name__ == "__main__":
+    # Instantiate the Optimizer with the necessary parameters
+    optimizer = Optimizer(tolerance=0.001, max_iter=100)
+
+    # Perform the general search to find the optimal point
+    best_alpha = optimizer.general_search(example_function, param_range=(0, 1), step=0.05)
 
-# Instantiate the Optimizer with the necessary parameters
-optimizer = Optimizer(tolerance=0.001, max_iter=100)
+    print(f"Best Alpha: {best_alpha}")
 
-# Perform the general search to find the optimal point
-best_alpha = optimizer.general_search(example_function, param_range=(0, 1), step=0.05)
+    # The example function also accepts arrays, so every step is a single call
+    optimizer = Optimizer(tolerance=0.001, max_iter=100, vectorized=True)
+    best_alpha = optimizer.general_search(example_function, param_range=(0, 1), step=0.05)
 
-print(f"Best Alpha: {best_alpha}")
+    print(f"Best Alpha (vectorized): {best_alpha}")
 
@@ -0,0 +1,110 @@
+from sqlite_wrapper import SQLiteWrapper
+import sys
+import re
+
+""" Wide player stats table, one row per player_performance with one column per statistic. Replaces the
+one-row-per-stat nrl_ps and player_stats tables. Columns for statistics that have not been seen before are
+added on demand, so new nrl.com stat keys load without a schema change. Run this module to migrate an
+existing database, add --drop-eav to drop the old tables and VACUUM afterwards."""
+
+COLUMN_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+# player_performance.source of each importer, also their ingest manifest source names. Both sources
+# share columns such as tries and goals, so every aggregate over player_game_stats filters on one.
+FANTASY_SOURCE = "fantasy"
+NRL_SOURCE = "nrlstats"
+
+class PlayerGameStats():
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+        self.get_columns()
+
+    def get_columns(self):
+        query = "PRAGMA table_info(player_game_stats);"
+        rows = self.wrapper.fetch_all(query)
+        self.columns = {x[1].lower() for x in rows}
+
+    def stat_columns(self):
+        return sorted(self.columns - {"player_performance_id", "is_home_team"})
+
+    def has_column(self, name):
+        return name.lower() in self.columns
+
+    def add_column(self, name):
+        if not COLUMN_PATTERN.match(name):
+            raise ValueError(f"{name} is not a valid statistic name")
+        query = f'ALTER TABLE player_game_stats ADD COLUMN "{name}" REAL;'
+        self.wrapper.execute_query(query)
+        self.columns.add(name.lower())
+        print("INFO", f"Added column {name} to player_game_stats")
+
+    def ensure_columns(self, names):
+        for name in names:
+            if not self.has_column(name):
+                self.add_column(name)
+
+    def write(self, rows):
+        """
+        rows is a list of (player_performance_id, is_home_team, {stat: value}). Each importer writes
+        the stats of its own performances, rows are upserted so a reload can write them again.
+        """
+        batches = {}
+        for performance_id, is_home, stats in rows:
+            self.ensure_columns(stats.keys())
+            names = tuple(sorted(stats.keys()))
+            parameters = (performance_id, is_home) + tuple(stats[x] for x in names)
+            batches.setdefault(names, []).append(parameters)
+
+        for names, parameters in batches.items():
+            columns = ", ".join(["player_performance_id", "is_home_team"] + [f'"{x}"' for x in names])
+            placeholders = ", ".join(["?"] * (len(names) + 2))
+            updates = ", ".join(["is_home_team = excluded.is_home_team"] + [f'"{x}" = excluded."{x}"' for x in names])
+            query = f"""INSERT INTO player_game_stats ({columns}) VALUES ({placeholders})
+                    ON CONFLICT(player_performance_id) DO UPDATE SET {updates};"""
+            self.wrapper.execute_many(query, parameters)
+
+    def migrate(self):
+        """
+        Pivots nrl_ps and player_stats into player_game_stats in a single GROUP BY pass.
+        """
+        query = """SELECT DISTINCT stat_type FROM nrl_ps
+                UNION SELECT DISTINCT stat_type FROM player_stats;"""
+        stat_types = [x[0] for x in self.wrapper.fetch_all(query)]
+        valid = [x for x in stat_types if COLUMN_PATTERN.match(x)]
+        for name in set(stat_types) - set(valid):
+            print("ERROR", f"Skipping statistic {name}, not a valid column name")
+
+        with self.wrapper.transaction():
+            self.ensure_columns(valid)
+            columns = ", ".join([f'"{x}"' for x in valid])
+            pivots = ", ".join([f"MAX(CASE WHEN s.stat_type = '{x}' THEN s.value END)" for x in valid])
+            query = f"""INSERT OR REPLACE INTO player_game_stats (player_performance_id, is_home_team, {columns})
+                    SELECT s.player_performance_id, game_teams.is_home_team, {pivots}
+                    FROM (
+                        SELECT player_performance_id, stat_type, value FROM nrl_ps
+                        UNION ALL
+                        SELECT player_performance_id, stat_type, count FROM player_stats
+                        ) s
+                    JOIN player_performance ON player_performance.id = s.player_performance_id
+                    JOIN game_teams ON game_teams.game_id = player_performance.game_id
+                        AND game_teams.team_id = player_performance.team_id
+                    GROUP BY s.player_performance_id;"""
+            self.wrapper.execute_query(query)
+        count = self.wrapper.fetch_one("SELECT COUNT(*) FROM player_game_stats;")[0]
+        print("INFO", f"player_game_stats holds {count} performances")
+
+    def drop_eav_tables(self):
+        self.wrapper.execute_query("DROP TABLE IF EXISTS nrl_ps;")
+        self.wrapper.execute_query("DROP TABLE IF EXISTS player_stats;")
+        self.wrapper.execute_query("VACUUM;")
+        print("INFO", "nrl_ps and player_stats dropped")
+
+
+if __name__ == "__main__":
+    wrapper = SQLiteWrapper(db_name = "/home/paul/Projects/NRLAnalysis/database.db", profile = "bulk-load")
+    wrapper.connect()
+    stats_table = PlayerGameStats(wrapper)
+    stats_table.migrate()
+    if "--drop-eav" in sys.argv:
+        stats_table.drop_eav_tables()
+    wrapper.close()
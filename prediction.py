@@ -2,6 +2,7 @@ import numpy as np
 import json
 from sqlite_wrapper import SQLiteWrapper
 from db_analysis import Regression
+from team_form import add_team_form
 import pandas as pd
 import os
 import statsmodels.api as sm
@@ -25,33 +26,9 @@ class Predictor():
 
 
     
-    def get_team_form(self, game_id, team, sample_size=5):
-        team_games = self.df[((self.df["home"] == team) | (self.df["away"] == team)) & (self.df["game_id"] < game_id)].tail(sample_size)
-        if team_games.shape[0] == 0:
-            return(0, 0, 0)
-
-        no_games = team_games.shape[0]
-        home_games = team_games[(team_games["home"] == team)]
-        away_games = team_games[(team_games["away"] == team)]
-        avg_home_games = (team_games['home'] == team).sum() / no_games
-
-        avg_residuals = team_games.mean()
-        avg_residuals = team_games["residuals"].mean()
-        avg_points = team_games["points"].mean()
-
-        return(avg_home_games, avg_points, avg_residuals)
-
-    def get_form(self, game_id):
-        home_team = self.df["home"][game_id]
-        away_team = self.df["away"][game_id]
-        home_form = self.get_team_form(game_id, home_team)
-        away_form = self.get_team_form(game_id, away_team)
-        self.df.loc[game_id, ["form_home","form_points","form_residuals"]] += home_form
-        self.df.loc[game_id, ["form_home","form_points","form_residuals"]] -= away_form
-
-    def add_form(self):
-        for game_id in range(15, self.df.shape[0]):
-            self.get_form(game_id)
+    def add_form(self, windows=(5,), halflives=()):
+        # form over each team's previous games, the first games of the range have no history
+        self.df = add_team_form(self.df, columns=("points", "residuals"), windows=windows, halflives=halflives)
         self.df = self.df.tail(self.df.shape[0] - 16)
 
     def get_model(self):
@@ -89,9 +66,6 @@ class Predictor():
         predictions = X.dot(coefs)
         self.df["predicted"] = predictions
         self.df["residuals"] = self.df["points"] - predictions
-        self.df["form_points"] = 0
-        self.df["form_residuals"] = 0
-        self.df["form_home"] = 0
 
 
 
@@ -1,4 +1,4 @@
-rm database.db
+rm -f database.db database.db-wal database.db-shm
 sqlite3 database.db < schema.sql
 python3 create_venues.py
 sqlite3 database.db < load_teams.sql
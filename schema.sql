@@ -7,7 +7,7 @@ CREATE TABLE IF NOT EXISTS "venues"(
 
 CREATE TABLE IF NOT EXISTS "venue_linker"(
     venue_id INTEGER NOT NULL,
-    ff_venue_id INTEGER NOT NULL,
+    ff_venue_id INTEGER NOT NULL UNIQUE,
     FOREIGN KEY(venue_id) REFERENCES venues(id));
 
 CREATE TABLE IF NOT EXISTS "teams"(
@@ -18,9 +18,33 @@ CREATE TABLE IF NOT EXISTS "teams"(
     FOREIGN KEY(home_venue_id) REFERENCES venues(id)
 );
 
+CREATE TABLE IF NOT EXISTS "travel_distances"(
+    team_id INTEGER NOT NULL,
+    venue_id INTEGER NOT NULL,
+    distance REAL NOT NULL,
+    PRIMARY KEY (team_id, venue_id),
+    FOREIGN KEY(team_id) REFERENCES teams(id),
+    FOREIGN KEY(venue_id) REFERENCES venues(id)
+) WITHOUT ROWID;
+
+-- stale distances are deleted here and recomputed by travel_distances.py
+CREATE TRIGGER IF NOT EXISTS travel_distances_venue_moved
+AFTER UPDATE OF latitude, longitude ON venues
+BEGIN
+    DELETE FROM travel_distances
+    WHERE venue_id = NEW.id
+    OR team_id IN (SELECT id FROM teams WHERE home_venue_id = NEW.id);
+END;
+
+CREATE TRIGGER IF NOT EXISTS travel_distances_home_changed
+AFTER UPDATE OF home_venue_id ON teams
+BEGIN
+    DELETE FROM travel_distances WHERE team_id = NEW.id;
+END;
+
 CREATE TABLE IF NOT EXISTS "players"(
     id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
-    ff_player_id INT NOT NULL,
+    ff_player_id INT NOT NULL UNIQUE,
     first_name VARCHAR(30),
     last_name VARCHAR(30));
 
@@ -37,6 +61,8 @@ CREATE TABLE IF NOT EXISTS games (
     ground_conditions VARCHAR(100),
     ff_game_id INTEGER NOT NULL,
     nrl_stats_loaded BOOL NOT NULL DEFAULT 0,
+    fantasy_stats_loaded BOOL NOT NULL DEFAULT 0,
+    UNIQUE (year, ff_game_id),
     FOREIGN KEY(venue_id) REFERENCES venues(id)
 );
 
@@ -60,10 +86,55 @@ CREATE TABLE IF NOT EXISTS "player_performance"(
     team_id INTEGER NOT NULL,
     player_id INTEGER NOT NULL,
     position varchar(30),
+    -- importer that wrote the row, fantasy and nrlstats performances of a game are separate rows
+    source VARCHAR(20) NOT NULL,
     FOREIGN KEY(game_id) REFERENCES games(id),
     FOREIGN KEY(player_id) REFERENCES players(id),
     FOREIGN KEY(team_id) REFERENCES teams(id));
 
+CREATE TABLE IF NOT EXISTS "player_game_stats"(
+    player_performance_id INTEGER PRIMARY KEY NOT NULL,
+    is_home_team BOOLEAN NOT NULL,
+    -- fantasy statistics, nrl.com statistics are added as REAL columns on first load
+    tries INTEGER,
+    tries_saved INTEGER,
+    goals INTEGER,
+    field_goals INTEGER,
+    try_assists INTEGER,
+    line_breaks INTEGER,
+    line_break_assists INTEGER,
+    tackles INTEGER,
+    tackle_breaks INTEGER,
+    missed_tackles INTEGER,
+    offloads INTEGER,
+    errors INTEGER,
+    forty_twenty INTEGER,
+    forced_turnover INTEGER,
+    meters_gained INTEGER,
+    kick_meters INTEGER,
+    kicks_defused INTEGER,
+    penalties_conceded INTEGER,
+    sin_bins INTEGER,
+    send_off INTEGER,
+    minutes_played INTEGER,
+    forced_drop_outs INTEGER,
+    offloads_to_hand INTEGER,
+    offloads_to_ground INTEGER,
+    six_again_infringement INTEGER,
+    escape_ingoal INTEGER,
+    fantasy_points INTEGER,
+    FOREIGN KEY(player_performance_id) REFERENCES player_performance(id)
+);
+
+CREATE TABLE IF NOT EXISTS "player_stats"(
+    id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    player_performance_id INTEGER NOT NULL,
+    stat_type VARCHAR(50) NOT NULL,
+    count INTEGER NOT NULL,
+    is_home_team BOOLEAN NOT NULL,
+    FOREIGN KEY(player_performance_id) REFERENCES player_performance(id)
+);
+
 CREATE TABLE IF NOT EXISTS "nrl_ps"(
     id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
     player_performance_id INTEGER NOT NULL,
@@ -71,6 +142,23 @@ CREATE TABLE IF NOT EXISTS "nrl_ps"(
     value REAL NOT NULL,
     FOREIGN KEY(player_performance_id) REFERENCES player_performance(id)
 );
+CREATE TABLE IF NOT EXISTS "ingest_manifest"(
+    source VARCHAR(30) NOT NULL,
+    file_path VARCHAR(255) NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    hash VARCHAR(40) NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    loaded_at VARCHAR(30),
+    PRIMARY KEY (source, file_path)
+) WITHOUT ROWID;
+
+-- incremental job progress, e.g. the highest player_performance id assess_winners has checked
+CREATE TABLE IF NOT EXISTS "watermarks"(
+    name VARCHAR(50) PRIMARY KEY NOT NULL,
+    value INTEGER NOT NULL
+) WITHOUT ROWID;
+
 CREATE TABLE IF NOT EXISTS "nrl_venue_linker"(
     nrl_name VARCHAR(50) NOT NULL,
     venue_id INT NOT NULL,
@@ -1,60 +1,67 @@
 import os
-import requests
 from bs4 import BeautifulSoup
+from http_client import HTTPClient, ResponseCache
+from archive import JSONArchive
+from checkpoint import CheckpointStore
 import time
 import re
 import datetime
 import json
 
+DISCOVERY_FILEPATH = '/home/paul/Projects/NRLAnalysis/matches/discovery.json'
+SCRAPING_ERROR_LOG = '/home/paul/Projects/NRLAnalysis/matches/scraping_errors.log'
+# the site answers 403 from its bot protection as well as 429 when it wants a slower crawl
+RETRY_STATUSES = (403, 429, 500, 502, 503, 504)
+
 class Scrape():
-    def __init__(self):
-        self.requests = self.import_requests()
+    def __init__(self, offline=False):
         self.crawl_delay = 5
         self.retry_delay = 30
         self.max_attempts = 30
         self.last_html_request = time.time() - self.crawl_delay
-
-    def import_requests(self):
-        from curl_cffi import requests as req
-        return req
+        self.client = HTTPClient(
+                retries=self.max_attempts - 1,
+                backoff=self.crawl_delay,
+                max_backoff=self.retry_delay,
+                retry_statuses=RETRY_STATUSES,
+                timeout=10,
+                impersonate="chrome",
+                cache=self.get_cache(offline))
+        # player and venue ids of every completed match, see get_discovery_index
+        self.discovery = CheckpointStore(DISCOVERY_FILEPATH, default={})
+
+    def get_cache(self, offline):
+        # player and venue pages are only read for fixed details, completed
+        # matches are pinned in analyze_match
+        return ResponseCache(
+                "/home/paul/Projects/NRLAnalysis/cache/rlp",
+                ttl_rules=[(r"/(players|venues)/\d+$", None), (r"/seasons/", 86400)],
+                default_ttl=3600,
+                offline=offline)
 
     def get_html(self, url, headers, attempt=0):
-        # If I continue to run into issues with this I should create a queue 
-        # with the url etc and rerun at the end of the scrape maybe have less
-        # retries
-        retries = 30  # Number of retries before giving up
-        elapsed_time = time.time() - self.last_html_request
-        delay = max((self.crawl_delay - elapsed_time), 0)
-        time.sleep(delay)
-
-        for _ in range(retries):
+        if not self.client.is_cached(url):
+            elapsed_time = time.time() - self.last_html_request
+            delay = max((self.crawl_delay - elapsed_time), 0)
+            time.sleep(delay)
             self.last_html_request = time.time()
-            try:
-                if headers!=None:
-                    response = self.requests.get(url,headers = headers, timeout=10)
-                else:
-                    response = self.requests.get(url, timeout=10)
-                if response.status_code == 200:
-                    return BeautifulSoup(response.content, features="html.parser") 
-                else:
-                    # Log the URL with error status code
-                    #self.log_error(url)
-                    continue
-            except Exception as e:
-                #self.log_error(str(e))
-                time.sleep(self.retry_delay)
-            
-            # If all retries fail, log and return False
-        self.log_error(f"Failed to extract products from {url} after {retries} retries")
-        return False
+        try:
+            response = self.client.get(url, headers=headers)
+        except Exception as e:
+            self.log_error(f"Failed to fetch {url}: {e!r}")
+            return False
+        if response.status_code != 200:
+            attempts = self.max_attempts if response.status_code in RETRY_STATUSES else 1
+            self.log_error(f"Failed to fetch {url}, status code {response.status_code} after {attempts} attempts")
+            return False
+        return BeautifulSoup(response.content, features="html.parser")
 
     def log_error(self, message):
         # Log the error message to a file or any other preferred destination
         print(message)
-        error_file = self.config.get_scraping_error_log()
-        with open(error_file, "a") as f:
+        with open(SCRAPING_ERROR_LOG, "a") as f:
             f.write(message + " ")
-            f.write(str(datetime.now()) + "\n")
+            f.write(str(datetime.datetime.now()) + "\n")
 
 def get_round_info(soup):
     a = soup.find('th', class_='boldshade')
@@ -249,15 +256,16 @@ def get_scoresheet(soup):
         scoretype = get_scoretype(scoretype, row)
         add_score_row(scores, row, scoretype)
     return scores
+# completed matches are appended to a per season archive instead of a file each
+MATCH_ARCHIVE = JSONArchive('/home/paul/Projects/NRLAnalysis/matches/archive')
+
 def save_match(match_info):
-    filepath = "/home/paul/Projects/NRLAnalysis/matches/"
     if match_info["status"] == "Completed":
-        filepath += "Completed/"
+        MATCH_ARCHIVE.append(match_info["year"], match_info["rlp_no"] + ".json", match_info)
     else:
-        filepath += "Scheduled"
-    filename = filepath + match_info["rlp_no"] + ".json"
-    with open(filename, "w") as f:
-        json.dump(match_info, f, indent=4)
+        filename = "/home/paul/Projects/NRLAnalysis/matches/Scheduled" + match_info["rlp_no"] + ".json"
+        with open(filename, "w") as f:
+            json.dump(match_info, f, indent=4)
     with open("/home/paul/Projects/NRLAnalysis/analyzed_list.txt","a") as f:
         f.write(f'{match_info["year"]} Round {match_info["round"]} {match_info["home team"]} vs {match_info["away team"]}\n')
 def analyze_match(scraper, url):
@@ -275,7 +283,11 @@ def analyze_match(scraper, url):
     match_info["players"] = players
     match_info["coaches"] = coaches
     match_info["scores"] = get_scoresheet(soup)
+    if match_info["status"] == "Completed":
+        scraper.client.pin(url)
     save_match(match_info)
+    if match_info["status"] == "Completed":
+        scraper.discovery.set([rlp_no], get_match_ids(match_info))
 
 def get_match_url(soup):
     return 'https://www.rugbyleagueproject.org/'+re.findall(r"matches\/\d+", str(soup))[0]
@@ -283,10 +295,40 @@ def get_match_url(soup):
 def is_match(soup):
     return re.search(r"\/matches\/\d+", str(soup))
 
-def get_matches(scraper, url):
+def get_saved_matches():
     directory = '/home/paul/Projects/NRLAnalysis/matches/Completed'
-    saved_matches = [x.replace(".json","") for x in os.listdir(directory)]
-    
+    saved_matches = set([x.replace(".json","") for x in os.listdir(directory)])
+    return saved_matches | set([x.replace(".json","") for x in MATCH_ARCHIVE.get_names()])
+
+def get_match_ids(match_info):
+    players = [p["player_number"] for p in match_info['players']['home'] + match_info['players']['away']]
+    return {"players": sorted(set([x for x in players if x])), "venue": match_info.get("venue_id")}
+
+def get_discovery_index(scraper):
+    """
+    Returns {rlp_no: {"players": [...], "venue": id}} for every completed match. analyze_match keeps
+    it up to date, only matches saved without it are read here, once.
+    """
+    discovery = scraper.discovery
+    directory = '/home/paul/Projects/NRLAnalysis/matches/Completed/'
+    for file in os.listdir(directory):
+        if file.replace(".json","") not in discovery:
+            with open(directory + file, "r") as f:
+                discovery.set([file.replace(".json","")], get_match_ids(json.load(f)))
+    for season in MATCH_ARCHIVE.get_seasons():
+        names = set([x for x in MATCH_ARCHIVE.get_index(season) if x.replace(".json","") not in discovery])
+        if not names:
+            continue
+        for name, game_data in MATCH_ARCHIVE.iter_season(season):
+            if name in names:
+                discovery.set([name.replace(".json","")], get_match_ids(game_data))
+    discovery.compact()
+    return discovery.state
+
+def get_matches(scraper, url, saved_matches=None):
+    # pass the same saved_matches set for every season to list the folder only once
+    if saved_matches is None:
+        saved_matches = get_saved_matches()
 
     soup = scraper.get_html(url, None)
     links = soup.find_all('a')
@@ -296,6 +338,7 @@ def get_matches(scraper, url):
         if match_no not in saved_matches:
             try:
                 analyze_match(scraper, url)
+                saved_matches.add(match_no)
             except Exception as e:
                 print(f"Match {url} fatal error:{e}")
 
@@ -346,62 +389,28 @@ def get_venue_data(scraper, venue_no):
         pass
     return venue
 
-def save_players(players):
-    with open('/home/paul/Projects/NRLAnalysis/players.json', 'w') as f:
-        json.dump(players, f, indent=4)
-
-def save_venues(venues):
-    with open('/home/paul/Projects/NRLAnalysis/venues.json', 'w') as f:
-        json.dump(venues, f, indent=4)
-
 def get_player_list(scraper):
-    directory = '/home/paul/Projects/NRLAnalysis/matches/Completed/'
-    files = os.listdir(directory)
-    player_list = []
-    for file in files[:]:
-        filename = directory + file
-        with open (filename, "r") as f:
-            game_data = json.load(f)
-        for p in game_data['players']['home']:
-            player_list.append(p["player_number"])
-        for p in game_data['players']['away']:
-            player_list.append(p["player_number"])
-    player_list = list(set(player_list))
-    no_players = len(player_list)
-    with open('/home/paul/Projects/NRLAnalysis/players.json', 'r') as f:
-        try:
-            players = json.load(f)
-        except json.decoder.JSONDecodeError:
-            print("can't decode")
-            players = {}
-    for index,player_no in enumerate(player_list[:]):
-        if player_no and str(player_no) not in players:
-            print(f"player {player_no} {index} of {no_players}")
-            players[player_no] = (get_player_data(scraper, player_no))
-            save_players(players)
+    player_list = set()
+    for match_ids in get_discovery_index(scraper).values():
+        player_list.update(match_ids["players"])
+    # each fetched player is appended to players.json.log, players.json is rewritten every 100
+    players = CheckpointStore('/home/paul/Projects/NRLAnalysis/players.json', default={})
+    missing = sorted([x for x in player_list if x not in players])
+    no_players = len(missing)
+    for index,player_no in enumerate(missing):
+        print(f"player {player_no} {index + 1} of {no_players}")
+        players.set([player_no], get_player_data(scraper, player_no))
+    players.close()
 
 def get_venue_list(scraper):
-    directory = '/home/paul/Projects/NRLAnalysis/matches/Completed/'
-    files = os.listdir(directory)
-    venue_list = []
-    for file in files[:]:
-        filename = directory + file
-        with open (filename, "r") as f:
-            game_data = json.load(f)
-            venue_list.append(game_data["venue_id"])
-    venue_list = list(set(venue_list))
-    no_venues = len(venue_list)
-    with open('/home/paul/Projects/NRLAnalysis/venues.json', 'r') as f:
-        try:
-            venues = json.load(f)
-        except json.decoder.JSONDecodeError:
-            print("can't decode")
-            venues = {}
-    for index,venue_no in enumerate(venue_list[:]):
-        if venue_no and str(venue_no) not in venues:
-            print(f"venue {venue_no} {index + 1} of {no_venues}")
-            venues[venue_no] = (get_venue_data(scraper, venue_no))
-            save_venues(venues)
+    venue_list = set([x["venue"] for x in get_discovery_index(scraper).values() if x["venue"]])
+    venues = CheckpointStore('/home/paul/Projects/NRLAnalysis/venues.json', default={})
+    missing = sorted([x for x in venue_list if x not in venues])
+    no_venues = len(missing)
+    for index,venue_no in enumerate(missing):
+        print(f"venue {venue_no} {index + 1} of {no_venues}")
+        venues.set([venue_no], get_venue_data(scraper, venue_no))
+    venues.close()
 
 
 
@@ -411,6 +420,7 @@ scraper = Scrape()
 player_list = get_venue_list(scraper)
 #url = "http://www.rugbyleagueproject.org/matches/103171"
 #analyze_match(scraper, url)
+#saved_matches = get_saved_matches()
 #for year in range(2014, 2020):
     #url = f"https://www.rugbyleagueproject.org/seasons/nrl-{year}/data.html"
-    #get_matches(scraper, url)
+    #get_matches(scraper, url, saved_matches)
@@ -3,58 +3,350 @@ import time
 import sys
 import re
 import os
+from contextlib import contextmanager
+
+# Named connection profiles. "bulk-load" is for the importers and
+# remake_database.sh, "analytics" for read-only regression/prediction work.
+# WAL journaling lets analytics readers run while an import is writing.
+PROFILES = {
+    "default": {
+        "read_only": False,
+        "pragmas": {},
+        },
+    "bulk-load": {
+        "read_only": False,
+        "pragmas": {
+            "journal_mode": "WAL",
+            "synchronous": "OFF",
+            "cache_size": -262144,  # 256MB
+            "temp_store": "MEMORY",
+            "busy_timeout": 10000,
+            },
+        },
+    "analytics": {
+        "read_only": True,
+        "pragmas": {
+            "mmap_size": 1073741824,  # 1GB
+            "cache_size": -131072,  # 128MB
+            "temp_store": "MEMORY",
+            "busy_timeout": 10000,
+            },
+        },
+    }
+
+INDEX_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "indexes.sql")
+
+IDENTIFIER_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+# Statements used with different tables or columns. Identifiers cannot be bound, so each
+# (template, identifiers) pair is formatted once, validated and registered under its own name,
+# which keeps the statement text stable for sqlite3's statement cache.
+STATEMENT_TEMPLATES = {
+    "max_index": "SELECT MAX(id) FROM {table};",
+    "primary_key": "SELECT id FROM {table} WHERE {column} IS ?;",
+    "value_exists": "SELECT 1 FROM {table} WHERE {column} = ? LIMIT 1;",
+    "clear_table": "DELETE FROM {table};",
+    "reset_sequence": "DELETE FROM sqlite_sequence WHERE name = ?;",
+    }
 
 class SQLiteWrapper():
-    def __init__(self, db_name=None):
+    def __init__(self, db_name=None, profile="default", cached_statements=256):
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown connection profile {profile}, expected one of {list(PROFILES)}")
         self.db_name = db_name
+        self.profile = profile
+        # compiled statements kept per connection, see register_statement
+        self.cached_statements = cached_statements
         self.connection = None
         self.cursor = None
+        self.transaction_depth = 0
+        self.savepoint_count = 0
+        self.statements = {}
+        self.statement_stats = {}
+        self.query_keys = {}
 
     def get_max_index(self, table_name):
-        query = f"SELECT MAX(id) FROM {table_name};"
-        max_value = self.fetch_one(query)
-        if not len(max_value):
-            return None;
+        max_value = self.run_statement(self.get_statement("max_index", table=table_name), fetch="one")
+        if max_value is None:
+            return None
         return max_value[0]
 
     def get_primary_key(self, table_name, column_name, value):
-        query = f"SELECT id FROM ? WHERE ? IS ?"
-        parameters = (table_name, column_name, value)
-        print(parameters)
-        result = self.fetch_one(query, parameters)
-        return result[0]
-
+        name = self.get_statement("primary_key", table=table_name, column=column_name)
+        result = self.run_statement(name, (value,), fetch="one")
+        return result[0] if result is not None else None
 
     def value_exists(self, table_name, column_name, value):
-        query = f'SELECT 1 FROM {table_name} WHERE {column_name} = "{value}";'
-        result = self.fetch_one(query)
-        return result is not None
+        name = self.get_statement("value_exists", table=table_name, column=column_name)
+        return self.run_statement(name, (value,), fetch="one") is not None
+
+    def register_statement(self, name, query):
+        """
+        Adds a named statement to the registry. It is compiled once with EXPLAIN, so an unknown
+        table or column fails here rather than at first use, and the unchanged text is then served
+        from the connection's statement cache on every run.
+        """
+        if not sqlite3.complete_statement(query):
+            raise ValueError(f"{name} is not a complete statement: {query}")
+        self.cursor.execute("EXPLAIN " + query, (None,) * query.count("?"))
+        self.cursor.fetchall()
+        self.statements[name] = query
+
+    def get_statement(self, template, **identifiers):
+        """
+        Registers STATEMENT_TEMPLATES[template] for the given table/column names if needed and
+        returns the registered name.
+        """
+        for identifier in identifiers.values():
+            if not IDENTIFIER_PATTERN.match(identifier):
+                raise ValueError(f"{identifier} is not a valid identifier")
+        name = template + ":" + ".".join([identifiers[x] for x in sorted(identifiers)])
+        if name not in self.statements:
+            self.register_statement(name, STATEMENT_TEMPLATES[template].format(**identifiers))
+        return name
+
+    def run_statement(self, name, parameters=(), fetch=None):
+        """
+        Runs a registered statement. fetch is None, "one" or "all".
+        """
+        start = time.perf_counter()
+        try:
+            self.cursor.execute(self.statements[name], parameters)
+            if fetch == "one":
+                return self.cursor.fetchone()
+            if fetch == "all":
+                return self.cursor.fetchall()
+        except sqlite3.Error as e:
+            print("ERROR",f"Error executing statement {name}:{str(e)}")
+            if self.in_transaction():
+                raise
+        finally:
+            self.record_timing(name, start)
+
+    def record_timing(self, key, start):
+        stats = self.statement_stats.setdefault(key, [0, 0.0])
+        stats[0] += 1
+        stats[1] += time.perf_counter() - start
+
+    def get_statement_stats(self, limit=None):
+        """
+        Returns (statement, calls, total seconds, mean seconds) sorted by total time. Registered
+        statements are keyed by name, bulk_upsert by its table and columns, other queries by their
+        first 80 characters. A batch (execute_many, insert_many) counts as one call.
+        """
+        stats = [(key, x[0], x[1], x[1] / x[0]) for key, x in self.statement_stats.items()]
+        stats.sort(key=lambda x: x[2], reverse=True)
+        return stats[:limit]
+
+    def print_statement_stats(self, limit=10):
+        for key, calls, total, mean in self.get_statement_stats(limit):
+            print("INFO", f"{total:9.3f}s {calls:8d} calls {mean * 1000:8.3f}ms  {key}")
+
+    def get_query_key(self, query):
+        # normalised once per distinct query text
+        key = self.query_keys.get(query)
+        if key is None:
+            key = self.query_keys[query] = " ".join(query.split())[:80]
+        return key
 
     def connect(self):
         try:
-            self.connection = sqlite3.connect(self.db_name)
+            settings = PROFILES[self.profile]
+            # autocommit mode, transactions are opened explicitly with begin()
+            if settings["read_only"]:
+                uri = f"file:{os.path.abspath(self.db_name)}?mode=ro"
+                self.connection = sqlite3.connect(uri, uri=True, isolation_level=None, cached_statements=self.cached_statements)
+            else:
+                self.connection = sqlite3.connect(self.db_name, isolation_level=None, cached_statements=self.cached_statements)
+            # compiled statements belong to the connection, they are validated again on first use
+            self.statements = {}
             self.cursor = self.connection.cursor()
+            self.set_pragmas(settings["pragmas"])
         except sqlite3.Error as e:
             print("ERROR",f"Error connecting to SQLite database:{self.db_name}\n{e}")
 
+    def set_pragmas(self, pragmas):
+        for name, value in pragmas.items():
+            self.cursor.execute(f"PRAGMA {name} = {value};")
+            self.cursor.fetchall()
+
+    def in_transaction(self):
+        return self.transaction_depth > 0
+
+    def begin(self):
+        self.cursor.execute("BEGIN;")
+        self.transaction_depth = 1
+
+    def commit(self):
+        self.cursor.execute("COMMIT;")
+        self.transaction_depth = 0
+
+    def rollback(self):
+        self.cursor.execute("ROLLBACK;")
+        self.transaction_depth = 0
+
+    @contextmanager
+    def transaction(self):
+        """
+        Groups every statement in the block into a single transaction that is
+        committed on exit and rolled back if the block raises. Nested calls
+        become savepoints of the outer transaction.
+        """
+        if self.in_transaction():
+            with self.savepoint():
+                yield self
+            return
+        self.begin()
+        try:
+            yield self
+        except BaseException:
+            self.rollback()
+            print("ERROR", "Transaction rolled back")
+            raise
+        self.commit()
+
+    @contextmanager
+    def savepoint(self, name=None, on_error=None):
+        """
+        Makes the block atomic inside the current transaction (e.g. one game
+        of a folder load). On error only the work since the savepoint is undone.
+        With on_error the error is logged and passed to on_error(e) instead of
+        raised, so the rest of the transaction still commits.
+        """
+        if not self.in_transaction():
+            with self.transaction():
+                with self.savepoint(name, on_error):
+                    yield self
+            return
+        self.savepoint_count += 1
+        name = name or f"sp_{self.savepoint_count}"
+        self.cursor.execute(f"SAVEPOINT {name};")
+        self.transaction_depth += 1
+        try:
+            yield self
+        except BaseException as e:
+            self.cursor.execute(f"ROLLBACK TO {name};")
+            self.cursor.execute(f"RELEASE {name};")
+            self.transaction_depth -= 1
+            if on_error is None or not isinstance(e, Exception):
+                raise
+            print("ERROR", f"Rolled back to savepoint {name}: {e!r}")
+            on_error(e)
+            return
+        self.cursor.execute(f"RELEASE {name};")
+        self.transaction_depth -= 1
+
     def execute_query(self, query, parameters=()):
+        start = time.perf_counter()
         try:
             self.cursor.execute(query, parameters)
-            self.connection.commit()
         except sqlite3.Error as e:
             print("ERROR",f"Error executing query{query}:{str(e)}")
+            if self.in_transaction():
+                raise
+        finally:
+            self.record_timing(self.get_query_key(query), start)
 
     def execute_many(self, query, parameters_list):
+        start = time.perf_counter()
+        try:
+            # a batch is always atomic and committed once, not per row
+            with self.transaction():
+                self.cursor.executemany(query, parameters_list)
+        except sqlite3.Error as e:
+            print("ERROR",f"Error executing query{query}:{str(e)}")
+            if self.in_transaction():
+                raise
+        finally:
+            self.record_timing(self.get_query_key(query), start)
+
+
+    def insert(self, query, parameters=()):
+        """
+        Runs a single INSERT and returns the id of the row it created.
+        """
+        start = time.perf_counter()
+        try:
+            self.cursor.execute(query, parameters)
+            return self.cursor.lastrowid
+        except sqlite3.Error as e:
+            print("ERROR",f"Error executing query{query}:{str(e)}")
+            if self.in_transaction():
+                raise
+            return None
+        finally:
+            self.record_timing(self.get_query_key(query), start)
+
+    def insert_many(self, query, parameters_list):
+        """
+        Runs an INSERT for each parameter tuple and returns the created ids in
+        the same order. The batch is atomic, so the ids are never interleaved
+        with another writer's rows.
+        """
+        ids = []
+        start = time.perf_counter()
         try:
-            self.cursor.executemany(query, parameters_list)
-            self.connection.commit()
+            with self.transaction():
+                for parameters in parameters_list:
+                    self.cursor.execute(query, parameters)
+                    ids.append(self.cursor.lastrowid)
         except sqlite3.Error as e:
             print("ERROR",f"Error executing query{query}:{str(e)}")
-            self.connection.rollback()  # Rollback changes in case of error
+            if self.in_transaction():
+                raise
+            return None
+        finally:
+            self.record_timing(self.get_query_key(query), start)
+        return ids
 
+    def bulk_upsert(self, table_name, key_columns, value_columns, rows, insert_missing=False):
+        """
+        Applies rows of key values followed by new values with a single statement: the rows are
+        loaded into a temp table, then one UPDATE ... FROM (or INSERT ... ON CONFLICT DO UPDATE when
+        insert_missing, which needs a unique constraint on the keys) writes only the rows whose
+        values differ. Returns the number of rows changed.
+        """
+        columns = list(key_columns) + list(value_columns)
+        for name in [table_name] + columns:
+            if not IDENTIFIER_PATTERN.match(name):
+                raise ValueError(f"{name} is not a valid identifier")
+        temp_table = f"bulk_{table_name}"
+        keys = ", ".join(key_columns)
+        if insert_missing:
+            updates = ", ".join([f"{x} = excluded.{x}" for x in value_columns])
+            excluded_changed = " OR ".join([f"{table_name}.{x} IS NOT excluded.{x}" for x in value_columns])
+            query = f"""INSERT INTO {table_name} ({", ".join(columns)})
+                    SELECT {", ".join(columns)} FROM temp.{temp_table} WHERE true
+                    ON CONFLICT({keys}) DO UPDATE SET {updates} WHERE {excluded_changed};"""
+        else:
+            updates = ", ".join([f"{x} = changes.{x}" for x in value_columns])
+            matches = " AND ".join([f"{table_name}.{x} = changes.{x}" for x in key_columns])
+            changed = " OR ".join([f"{table_name}.{x} IS NOT changes.{x}" for x in value_columns])
+            query = f"""UPDATE {table_name} SET {updates}
+                    FROM temp.{temp_table} AS changes
+                    WHERE {matches} AND ({changed});"""
+        start = time.perf_counter()
+        try:
+            with self.transaction():
+                self.cursor.execute(f"DROP TABLE IF EXISTS temp.{temp_table};")
+                self.cursor.execute(f"CREATE TEMP TABLE {temp_table} ({', '.join(columns)}, PRIMARY KEY ({keys}));")
+                placeholders = ", ".join(["?"] * len(columns))
+                self.cursor.executemany(f"INSERT OR REPLACE INTO temp.{temp_table} VALUES ({placeholders});", rows)
+                self.cursor.execute(query)
+                count = self.cursor.rowcount
+                self.cursor.execute(f"DROP TABLE temp.{temp_table};")
+        except sqlite3.Error as e:
+            print("ERROR",f"Error executing query{query}:{str(e)}")
+            if self.in_transaction():
+                raise
+            return None
+        finally:
+            # temp table load and apply together, keyed by the target
+            self.record_timing(f"bulk_upsert:{table_name}({', '.join(value_columns)})", start)
+        return count
 
     def fetch_all(self, query, parameters=()):
-        start = time.time()
+        start = time.perf_counter()
         try:
             self.cursor.execute(query, parameters)
             rows = self.cursor.fetchall()
@@ -62,8 +354,11 @@ class SQLiteWrapper():
         except sqlite3.Error as e:
             print("ERROR",f"Error fetching data:{str(e)}")
             return None
+        finally:
+            self.record_timing(self.get_query_key(query), start)
 
     def fetch_one(self, query, parameters=()):
+        start = time.perf_counter()
         try:
             self.cursor.execute(query, parameters)
             row = self.cursor.fetchone()
@@ -71,21 +366,59 @@ class SQLiteWrapper():
         except sqlite3.Error as e:
             print("ERROR",f"Error fetching data:{str(e)}")
             return None
+        finally:
+            self.record_timing(self.get_query_key(query), start)
+
+    def read_index_statements(self, index_file=INDEX_FILE):
+        with open(index_file, "r") as f:
+            lines = [x for x in f.read().splitlines() if not x.strip().startswith("--")]
+        return [x.strip() for x in "\n".join(lines).split(";") if x.strip()]
+
+    def get_index_name(self, statement):
+        return re.search(r"INDEX IF NOT EXISTS (\w+)", statement).group(1)
+
+    def create_indexes(self, index_file=INDEX_FILE):
+        """
+        Builds the secondary indexes in indexes.sql that are missing, after
+        drop_indexes or a full reload that died before rebuilding them, and
+        then gathers full statistics with ANALYZE. When every index exists
+        only PRAGMA optimize runs, which analyzes just the stale tables.
+        """
+        existing = {x[0] for x in self.fetch_all("SELECT name FROM sqlite_master WHERE type = 'index';")}
+        missing = [x for x in self.read_index_statements(index_file) if self.get_index_name(x) not in existing]
+        if not missing:
+            self.cursor.execute("PRAGMA optimize;")
+            self.cursor.fetchall()
+            return
+        with self.transaction():
+            for statement in missing:
+                self.cursor.execute(statement)
+        self.cursor.execute("ANALYZE;")
+        print("INFO", f"{len(missing)} indexes created")
+
+    def drop_indexes(self, index_file=INDEX_FILE):
+        """
+        Drops the secondary indexes so a bulk load does not maintain them row
+        by row. Unique constraints are part of the schema and are kept.
+        """
+        with self.transaction():
+            for statement in self.read_index_statements(index_file):
+                index_name = self.get_index_name(statement)
+                self.cursor.execute(f"DROP INDEX IF EXISTS {index_name};")
+        print("INFO", "Indexes dropped")
 
     def clear_table(self, table_name):
-        delete_query = f"DELETE FROM {table_name}"
-        reset_query = f"DELETE FROM sqlite_sequence WHERE name IS '{table_name}'"
         try:
-            self.cursor.execute(delete_query)
-            self.connection.commit()
-            self.cursor.execute(reset_query)
-            self.connection.commit()
+            self.run_statement(self.get_statement("clear_table", table=table_name))
+            self.run_statement(self.get_statement("reset_sequence"), (table_name,))
             print("INFO", f"{table_name} cleared")
         except sqlite3.Error as e:
             print("ERROR",f"Error clearing_table:{str(e)}")
 
     def close(self):
         if self.connection:
+            if self.in_transaction():
+                self.commit()
             self.connection.close()
             print("INFO","Connection to SQLite database closed")
 
@@ -0,0 +1,64 @@
+import numpy as np
+import pandas as pd
+
+""" Team form features for a frame of games with one row per game in date order, home and away team
+columns and home perspective values (e.g. points margin). Games are reshaped to one row per (game,
+team) with the values from that team's perspective, so every window is computed for all teams at
+once from per team cumulative sums. A game's form only uses the games before it."""
+
+def get_long_format(df, columns, home_column="home", away_column="away"):
+    home = pd.DataFrame({"row": np.arange(len(df)), "team": df[home_column].to_numpy(), "is_home": 1.0})
+    away = pd.DataFrame({"row": np.arange(len(df)), "team": df[away_column].to_numpy(), "is_home": 0.0})
+    for column in columns:
+        home[column] = df[column].to_numpy(dtype=float)
+        away[column] = -df[column].to_numpy(dtype=float)
+    long = pd.concat([home, away], ignore_index=True)
+    return long.sort_values(["row", "is_home"], kind="stable").reset_index(drop=True)
+
+def get_rolling_form(long, values, window):
+    """
+    Mean of each value over the team's previous `window` games, 0 before a team's first game.
+    """
+    teams = long["team"]
+    previous_games = long.groupby(teams).cumcount().to_numpy()
+    sums = long[values].groupby(teams).cumsum()
+    # sums up to the previous game minus sums up to the game before the window
+    before = sums.groupby(teams).shift(1).fillna(0)
+    outside = sums.groupby(teams).shift(window + 1).fillna(0)
+    counts = np.minimum(previous_games, window)
+    form = (before - outside).to_numpy() / np.maximum(counts, 1)[:, None]
+    form[counts == 0] = 0
+    return pd.DataFrame(form, columns=values, index=long.index)
+
+def get_decayed_form(long, values, halflife):
+    """
+    Exponentially weighted mean of each value over all of the team's previous games.
+    """
+    teams = long["team"]
+    previous = long[values].groupby(teams).shift(1)
+    form = previous.groupby(teams).transform(lambda x: x.ewm(halflife=halflife).mean())
+    return form.fillna(0)
+
+def add_team_form(df, columns=("points", "residuals"), windows=(5,), halflives=(), home_column="home", away_column="away"):
+    """
+    Adds form_home (share of home games in the window) and form_{column} for each column as the
+    home team's form minus the away team's form. The first window uses the plain names, other
+    windows are suffixed with the window size and decayed forms with ewm{halflife}.
+    """
+    long = get_long_format(df, columns, home_column, away_column)
+    values = ["is_home"] + list(columns)
+    forms = [("" if index == 0 else f"_{x}", get_rolling_form(long, values, x)) for index, x in enumerate(windows)]
+    forms += [(f"_ewm{x}", get_decayed_form(long, values, x)) for x in halflives]
+
+    is_home = long["is_home"].to_numpy() == 1
+    home_rows = long["row"].to_numpy()[is_home]
+    away_rows = long["row"].to_numpy()[~is_home]
+    for suffix, form in forms:
+        home_form = np.empty((len(df), len(values)))
+        away_form = np.empty((len(df), len(values)))
+        home_form[home_rows] = form.to_numpy()[is_home]
+        away_form[away_rows] = form.to_numpy()[~is_home]
+        for index, value in enumerate(values):
+            name = "home" if value == "is_home" else value
+            df[f"form_{name}{suffix}"] = home_form[:, index] - away_form[:, index]
+    return df
@@ -0,0 +1,106 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.request import urlopen
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fetch_scheduler import FetchScheduler
+
+""" FetchScheduler against a local http.server stand-in. /ok/<n> always answers 200, /flaky/<n>
+answers 503 to its first two requests and 200 after that."""
+
+class StandIn(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((time.monotonic(), self.path))
+            attempts = sum([1 for x in server.requests if x[1] == self.path])
+        if self.path.startswith("/flaky/") and attempts <= 2:
+            self.send_response(503)
+            self.end_headers()
+            return
+        body = self.path.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def fetch(url):
+    with urlopen(url, timeout=5) as response:
+        return response.read().decode("utf-8")
+
+class FetchSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_results_in_order(self):
+        urls = [f"{self.base_url}/ok/{x}" for x in range(6)]
+        scheduler = FetchScheduler(fetch, requests_per_second=100, burst=6, max_in_flight=3)
+        self.assertEqual(list(scheduler.map(urls)), [f"/ok/{x}" for x in range(6)])
+
+    def test_rate_limit(self):
+        rate = 20
+        urls = [f"{self.base_url}/ok/{x}" for x in range(6)]
+        scheduler = FetchScheduler(fetch, requests_per_second=rate, burst=1, max_in_flight=4)
+        list(scheduler.map(urls))
+        times = sorted([x[0] for x in self.server.requests])
+        self.assertEqual(len(times), len(urls))
+        # with one token in the bucket the n-th request waits n / rate seconds
+        for index, arrived in enumerate(times):
+            self.assertGreaterEqual(arrived - times[0], index / rate - 0.02)
+
+    def test_burst(self):
+        urls = [f"{self.base_url}/ok/{x}" for x in range(4)]
+        scheduler = FetchScheduler(fetch, requests_per_second=0.5, burst=4, max_in_flight=4)
+        start = time.monotonic()
+        list(scheduler.map(urls))
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_retry_with_backoff(self):
+        backoff = 0.1
+        scheduler = FetchScheduler(fetch, requests_per_second=100, burst=1, retries=3, backoff=backoff)
+        # take the top of the jitter range so the delays are the full backoff
+        with mock.patch("fetch_scheduler.random.uniform", side_effect=lambda low, high: high):
+            self.assertEqual(list(scheduler.map([f"{self.base_url}/flaky/1"])), ["/flaky/1"])
+        times = [x[0] for x in self.server.requests]
+        self.assertEqual(len(times), 3)
+        self.assertGreaterEqual(times[1] - times[0], backoff)
+        self.assertGreaterEqual(times[2] - times[1], 2 * backoff)
+
+    def test_backoff_capped(self):
+        scheduler = FetchScheduler(fetch, requests_per_second=100, burst=1, retries=3, backoff=10, max_backoff=0.05)
+        delays = []
+        with mock.patch("fetch_scheduler.random.uniform", side_effect=lambda low, high: delays.append(high) or 0):
+            list(scheduler.map([f"{self.base_url}/flaky/1"]))
+        self.assertEqual(delays, [0.05, 0.05])
+
+    def test_retries_exhausted(self):
+        scheduler = FetchScheduler(fetch, requests_per_second=100, burst=1, retries=2, backoff=0.01)
+        with self.assertRaises(Exception):
+            list(scheduler.map([f"{self.base_url}/flaky/1"]))
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_cached_urls_skip_rate_limit(self):
+        urls = [f"{self.base_url}/ok/{x}" for x in range(5)]
+        scheduler = FetchScheduler(fetch, requests_per_second=0.5, burst=1, is_cached=lambda url: True)
+        start = time.monotonic()
+        list(scheduler.map(urls))
+        self.assertLess(time.monotonic() - start, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
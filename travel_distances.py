@@ -0,0 +1,77 @@
+from sqlite_wrapper import SQLiteWrapper
+import numpy as np
+
+""" Precomputed travel distance from every team's home ground to every venue, stored in the
+travel_distances table. Triggers in schema.sql delete the affected rows when a venue moves or a team
+changes home ground, refresh() then only computes the missing (team, venue) pairs."""
+
+EARTH_RADIUS_KM = 6371.0088
+
+def haversine(latitude_1, longitude_1, latitude_2, longitude_2):
+    """
+    Great circle distance in km, vectorised over numpy arrays of degrees.
+    """
+    latitude_1, longitude_1, latitude_2, longitude_2 = map(np.radians, (latitude_1, longitude_1, latitude_2, longitude_2))
+    a = np.sin((latitude_2 - latitude_1) / 2) ** 2 \
+        + np.cos(latitude_1) * np.cos(latitude_2) * np.sin((longitude_2 - longitude_1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+class TravelDistances():
+    def __init__(self, wrapper):
+        self.wrapper = wrapper
+        # pairs that could not be computed, logged once
+        self.missing = set()
+        self.refresh()
+        self.get_distances()
+
+    def get_missing_pairs(self):
+        query = """SELECT teams.id, venues.id, home.latitude, home.longitude, venues.latitude, venues.longitude
+                FROM teams
+                JOIN venues home ON home.id = teams.home_venue_id
+                CROSS JOIN venues
+                LEFT JOIN travel_distances ON travel_distances.team_id = teams.id
+                    AND travel_distances.venue_id = venues.id
+                WHERE travel_distances.team_id IS NULL
+                AND home.latitude IS NOT NULL
+                AND venues.latitude IS NOT NULL;"""
+        return self.wrapper.fetch_all(query)
+
+    def refresh(self):
+        pairs = self.get_missing_pairs()
+        if not pairs:
+            return
+        team_ids, venue_ids, home_latitudes, home_longitudes, venue_latitudes, venue_longitudes = zip(*pairs)
+        distances = haversine(
+                np.array(home_latitudes),
+                np.array(home_longitudes),
+                np.array(venue_latitudes),
+                np.array(venue_longitudes))
+        query = "INSERT OR REPLACE INTO travel_distances (team_id, venue_id, distance) VALUES (?, ?, ?);"
+        parameters = list(zip(team_ids, venue_ids, distances.tolist()))
+        self.wrapper.execute_many(query, parameters)
+        print("INFO", f"Computed {len(parameters)} travel distances")
+
+    def get_distances(self):
+        query = "SELECT team_id, venue_id, distance FROM travel_distances;"
+        self.distances = {(x[0], x[1]):x[2] for x in self.wrapper.fetch_all(query)}
+
+    def get_distance(self, team_id, venue_id):
+        """
+        Returns the distance in km, computing it first for a team or venue added since the last
+        refresh. None when the team's home venue or the venue has no coordinates.
+        """
+        key = (team_id, venue_id)
+        if key not in self.distances and key not in self.missing:
+            self.refresh()
+            self.get_distances()
+            if key not in self.distances:
+                self.missing.add(key)
+                print("ERROR", f"No travel distance for team {team_id} at venue {venue_id}, the team's home venue or the venue has no coordinates")
+        return self.distances.get(key)
+
+
+if __name__ == "__main__":
+    wrapper = SQLiteWrapper(db_name = "/home/paul/Projects/NRLAnalysis/database.db")
+    wrapper.connect()
+    TravelDistances(wrapper)
+    wrapper.close()